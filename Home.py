@@ -6,9 +6,27 @@ from google.oauth2.service_account import Credentials
 from datetime import datetime, timedelta
 import pytz
 import time
+import math
 import os
+import sys
 from pathlib import Path
-import random
+import re
+import json
+import collections
+import http.server
+import logging
+import functools
+import io
+import importlib.util
+import queue
+import sqlite3
+import threading
+import weakref
+import contextvars
+import csv
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import Future
 
 # Google Sheets 연결 설정
 @st.cache_resource
@@ -48,6 +66,7 @@ def init_google_sheets():
             creds = Credentials.from_service_account_info(credentials_dict, scopes=scope)
         
         client = gspread.authorize(creds)
+        instrument_http_client(client)
         
         if sheets_url:
             sheet_id = sheets_url.split("/d/")[1].split("/")[0]
@@ -188,238 +207,3087 @@ def is_phone_duplicate(stored_phone, input_phone):
     
     return stored_phone == formatted_input
 
+# 저장소 백엔드
+CUSTOMER_HEADERS = ["id", "name", "phone", "service_type", "registered_time", "status", "store_code", "estimated_time", "store_ticket_number"]
+STORE_HEADERS = ["store_code", "store_name", "team", "admin_id", "admin_pw"]
+TICKET_STATS_HEADERS = ["date", "store_code", "hour", "service_type", "issued", "completed"]
+STATUS_EVENT_HEADERS = [
+    "customer_id", "store_code", "service_type", "registered_time", "status", "event_time", "admin_id", "counter"
+]
+STATUS_EVENT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class StorageBackend(ABC):
+    """저장소 백엔드 인터페이스
+
+    값 조회 메서드는 Google Sheets의 get_all_values()와 같은 형태
+    (첫 행이 헤더인 문자열 2차원 리스트)로 반환합니다.
+    추상 메서드는 모든 백엔드가 구현해야 하고, 나머지는 기본 동작이 있는 선택 기능입니다.
+    """
+
+    # get_customer_values(store_code)가 인덱스로 매장별 조회를 하는지 여부
+    supports_store_filter = False
+    # 번호 발급(prepare_customer)과 행 저장(append_customer_row)을 나눌 수 있는지 여부
+    supports_deferred_add = False
+    # 설정되어 있으면 등록 시 번호만 바로 발급하고 저장은 파이프라인이 처리
+    registration_pipeline = None
+    # 설정되어 있으면 상태 변경을 모아서 저장 (StatusWriteQueue)
+    status_writer = None
+
+    @abstractmethod
+    def get_store_values(self):
+        """stores 테이블 값 조회"""
+
+    @abstractmethod
+    def get_customer_values(self, store_code=None):
+        """customers 테이블 값 조회 (store_code 지정 시 해당 매장 행만 반환할 수 있음)"""
+
+    @abstractmethod
+    def get_settings_values(self):
+        """settings 테이블 값 조회"""
+
+    @abstractmethod
+    def add_customer(self, name, phone, service_type, store_code, registered_time, estimated_time):
+        """고객 추가 후 (고객 ID, 매장별 티켓 번호) 반환"""
+
+    def prepare_customer(self, name, phone, service_type, store_code, registered_time, estimated_time):
+        """번호를 발급해 저장할 고객 행 생성 (supports_deferred_add인 백엔드만, 저장은 append_customer_row)"""
+        raise NotImplementedError(f"{type(self).__name__}는 번호 발급과 저장을 나눌 수 없습니다")
+
+    def append_customer_row(self, row):
+        """이미 번호가 정해진 고객 행 추가 (supports_deferred_add인 백엔드만)"""
+        raise NotImplementedError(f"{type(self).__name__}는 번호 발급과 저장을 나눌 수 없습니다")
+
+    def customer_row_group(self, row):
+        """한 번의 append_customer_rows로 함께 저장할 수 있는 행의 묶음 키"""
+        return None
+
+    def append_customer_rows(self, rows):
+        """같은 customer_row_group의 고객 행 여러 개 추가"""
+        for row in rows:
+            self.append_customer_row(row)
+
+    def peek_next_ticket(self, store_code):
+        """다음에 발급될 매장 티켓 번호 (저렴하게 알 수 없으면 None)"""
+        return None
+
+    def get_customer_version(self, store_code=None):
+        """고객 데이터 변경 토큰 (값이 같으면 마지막 조회 이후 변경 없음, 알 수 없으면 None)"""
+        return None
+
+    @abstractmethod
+    def update_customer_status(self, customer_id, new_status, store_code=None):
+        """고객 상태 변경 (성공 여부 반환, store_code를 알면 해당 매장 저장소만 조회)"""
+
+    def update_customer_statuses(self, updates):
+        """(고객 ID, 상태, 매장 코드) 목록을 한 번에 반영하고 변경된 고객 ID(문자열) 집합 반환"""
+        return {
+            str(customer_id) for customer_id, new_status, store_code in updates
+            if self.update_customer_status(customer_id, new_status, store_code)
+        }
+
+    @abstractmethod
+    def set_store_admin(self, store_name, admin_id, admin_pw):
+        """매장 관리자 정보 설정 (성공 여부 반환)"""
+
+    @abstractmethod
+    def archive_customers(self, cutoff, statuses, partition="month"):
+        """cutoff 이전에 등록된 statuses 상태의 고객을 기간별 보관 테이블로 이동 (이동한 행 수 반환)"""
+
+    def get_ticket_stats_values(self):
+        """ticket_stats 테이블 값 조회 (저장하지 않는 백엔드면 None)"""
+        return None
+
+    def save_ticket_stats(self, rows):
+        """ticket_stats 행(TICKET_STATS_HEADERS 순서) 저장, 같은 칸(date~service_type)은 덮어씀"""
+        pass
+
+    def get_status_event_values(self):
+        """status_events 테이블 값 조회 (저장하지 않는 백엔드면 None)"""
+        return None
+
+    def append_status_events(self, rows):
+        """상태 변경 기록(STATUS_EVENT_HEADERS 순서) 추가"""
+        pass
+
+    def archive_status_events(self, cutoff, partition="month"):
+        """cutoff 이전의 상태 변경 기록을 기간별 보관 테이블로 이동 (이동한 행 수 반환)"""
+        return 0
+
+class RowLocator:
+    """고객 ID → 시트 행 번호 색인
+
+    전체 스냅샷을 읽을 때 다시 만들고, 행을 추가할 때 이어 붙입니다.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self.headers = None
+
+    def rebuild(self, all_values):
+        """get_all_values() 결과로 색인 재구성"""
+        rows = {}
+        for i, row in enumerate(all_values[1:], start=2):
+            if row and row[0]:
+                rows[row[0]] = i
+        with self._lock:
+            self.headers = list(all_values[0]) if all_values else None
+            self._rows = rows
+
+    def add(self, customer_id, row_number):
+        if not row_number:
+            return
+        with self._lock:
+            self._rows[str(customer_id)] = row_number
+
+    def get(self, customer_id):
+        with self._lock:
+            return self._rows.get(str(customer_id))
+
+    def column(self, header):
+        """헤더 이름의 열 번호 (1부터 시작, 없으면 None)"""
+        with self._lock:
+            if self.headers and header in self.headers:
+                return self.headers.index(header) + 1
+        return None
+
+def _appended_row_number(response):
+    """append_row 응답의 updatedRange에서 추가된 행 번호 추출"""
+    try:
+        updated_range = response["updates"]["updatedRange"].split("!")[-1]
+        return int(re.match(r"[A-Z]+(\d+)", updated_range).group(1))
+    except Exception:
+        return None
+
+def ticket_counters_from_values(all_values):
+    """시트 값에서 (최대 고객 ID, {매장 코드: 최대 티켓 번호}) 계산"""
+    if not all_values:
+        return 0, {}
+
+    headers = all_values[0]
+    id_idx = headers.index("id") if "id" in headers else 0
+    store_idx = headers.index("store_code") if "store_code" in headers else 6
+    ticket_idx = headers.index("store_ticket_number") if "store_ticket_number" in headers else 8
+
+    max_id = 0
+    max_tickets = {}
+    for row in all_values[1:]:
+        if len(row) > id_idx and row[id_idx].isdigit():
+            max_id = max(max_id, int(row[id_idx]))
+        if len(row) > max(store_idx, ticket_idx) and row[ticket_idx].isdigit():
+            store_code = row[store_idx]
+            max_tickets[store_code] = max(max_tickets.get(store_code, 0), int(row[ticket_idx]))
+    return max_id, max_tickets
+
+def merge_ticket_counters(*counters):
+    """여러 (최대 ID, 매장별 최대 티켓) 결과를 합쳐 각각의 최댓값 반환"""
+    max_id = 0
+    max_tickets = {}
+    for counter_id, counter_tickets in counters:
+        max_id = max(max_id, counter_id)
+        for store_code, ticket in counter_tickets.items():
+            max_tickets[store_code] = max(max_tickets.get(store_code, 0), ticket)
+    return max_id, max_tickets
+
+def archive_partition_name(registered_time, partition="month", prefix="customers_archive_"):
+    """보관 시트/테이블 이름 (월별: customers_archive_202505, 일별: customers_archive_20250501)"""
+    return prefix + registered_time.strftime("%Y%m" if partition == "month" else "%Y%m%d")
+
+STATUS_EVENT_ARCHIVE_PREFIX = "status_events_archive_"
+
+def delete_row_blocks(workbook, sheet, row_numbers):
+    """행 번호들을 연속 묶음으로 나눠 아래쪽부터 지우는 요청을 한 번에 전송
+
+    위쪽 행 번호가 바뀌지 않고, 그 사이 아래에 추가된 새 행에도 영향이 없습니다.
+    """
+    blocks = []
+    for row_number in sorted(row_numbers):
+        if blocks and blocks[-1][1] == row_number - 1:
+            blocks[-1][1] = row_number
+        else:
+            blocks.append([row_number, row_number])
+    workbook.batch_update({"requests": [
+        {"deleteDimension": {"range": {
+            "sheetId": sheet.id, "dimension": "ROWS",
+            "startIndex": start - 1, "endIndex": end
+        }}}
+        for start, end in reversed(blocks)
+    ]})
+
+LAST_ID_COUNTER_KEY = "__last_id__"
+CUSTOMER_VERSION_COUNTER_KEY = "__customer_version__"
+
+class TicketAllocator:
+    """프로세스 전역 고객 ID / 매장별 티켓 번호 발급기
+
+    처음 발급할 때 한 번만 저장소에서 현재 최댓값을 읽고, 이후에는 잠금 안에서
+    카운터만 증가시키므로 O(1)이며 같은 프로세스의 동시 세션끼리 번호가 겹치지 않습니다.
+    발급된 번호는 추가된 고객 행에 그대로 남으므로 재시작 시 다시 읽어 이어서 발급합니다.
+    """
+
+    def __init__(self, load_counters):
+        self._load_counters = load_counters
+        # 초기화 중 전체 조회가 observe()를 호출하므로 재진입 가능한 잠금 사용
+        self._lock = threading.RLock()
+        self._last_id = None
+        self._last_tickets = {}
+
+    def _ensure_loaded(self):
+        if self._last_id is None:
+            self._last_id, self._last_tickets = self._load_counters()
+
+    def allocate(self, store_code):
+        """(새 고객 ID, 새 매장 티켓 번호) 발급"""
+        with self._lock:
+            self._ensure_loaded()
+            self._last_id += 1
+            ticket = self._last_tickets.get(store_code, 0) + 1
+            self._last_tickets[store_code] = ticket
+            return self._last_id, ticket
+
+    def peek(self, store_code):
+        """다음 티켓 번호 미리보기 (아직 초기화 전이면 None)"""
+        with self._lock:
+            if self._last_id is None:
+                return None
+            return self._last_tickets.get(store_code, 0) + 1
+
+    def observe(self, max_id, max_tickets):
+        """다른 프로세스가 추가한 행에서 본 번호보다 카운터가 뒤처지지 않게 올림"""
+        with self._lock:
+            if self._last_id is None:
+                return
+            self._last_id = max(self._last_id, max_id)
+            for store_code, ticket in max_tickets.items():
+                if ticket > self._last_tickets.get(store_code, 0):
+                    self._last_tickets[store_code] = ticket
+
+    def reset(self):
+        """다음 발급 시 저장소에서 카운터를 다시 읽음"""
+        with self._lock:
+            self._last_id = None
+            self._last_tickets = {}
+
+class CustomerSheet:
+    """고객 워크시트 하나의 동기화 상태 (행 색인, 마지막 동기화 스냅샷)
+
+    incremental_sync가 켜져 있으면 시트를 매번 처음부터 읽지 않고,
+    마지막으로 동기화한 행 이후의 새 행과 status 열만 가져와 기존 스냅샷에 합칩니다.
+    full_sync_interval초마다 한 번은 전체를 다시 읽어 다른 열의 수동 수정도 반영합니다.
+    """
+
+    def __init__(self, backend, title):
+        self.backend = backend
+        self.title = title
+        self.row_locator = RowLocator()
+        self._sync_lock = threading.RLock()
+        self._synced_values = None
+        self._last_full_sync = 0
+
+    def sheet(self, create=False):
+        """워크시트 핸들 (create=True면 없을 때 헤더와 함께 생성)"""
+        try:
+            return self.backend._worksheet(self.title)
+        except gspread.exceptions.WorksheetNotFound:
+            if not create:
+                raise
+            sheet = self.backend.workbook.add_worksheet(title=self.title, rows="1000", cols="10")
+            sheet.append_row(CUSTOMER_HEADERS)
+            self.backend._worksheets[self.title] = sheet
+            return sheet
+
+    def _remember_full_read(self, all_values):
+        """전체 조회 결과를 동기화 기준 스냅샷으로 저장"""
+        with self._sync_lock:
+            self._synced_values = all_values
+            self._last_full_sync = time.monotonic()
+        self.row_locator.rebuild(all_values)
+        self.backend.ticket_allocator.observe(*ticket_counters_from_values(all_values))
+
+    def full_sync(self):
+        all_values = self.sheet().get_all_values()
+        self._remember_full_read(all_values)
+        return all_values
+
+    def full_sync_due(self):
+        """주기적 전체 재조회가 필요한지 (시트를 직접 수정한 경우 반영용)"""
+        with self._sync_lock:
+            return (self._synced_values is None
+                    or time.monotonic() - self._last_full_sync > self.backend.full_sync_interval)
+
+    def forget(self):
+        """행 번호가 바뀐 뒤 다음 조회에서 전체를 다시 읽도록 함"""
+        with self._sync_lock:
+            self._synced_values = None
+        self.row_locator.rebuild([])
+
+    def read_values(self):
+        sheet = self.sheet()
+
+        with self._sync_lock:
+            synced = self._synced_values
+            if (not self.backend.incremental_sync or not synced
+                    or time.monotonic() - self._last_full_sync > self.backend.full_sync_interval):
+                return self.full_sync()
+
+            headers = synced[0]
+            synced_count = len(synced)
+            last_col = gspread.utils.rowcol_to_a1(1, len(headers))[:-1]
+
+            # 마지막 동기화 행부터 끝까지 + status 열을 한 번의 요청으로 조회
+            ranges = [f"A{synced_count}:{last_col}"]
+            status_idx = headers.index('status') if 'status' in headers else None
+            if status_idx is not None and synced_count > 1:
+                status_col = gspread.utils.rowcol_to_a1(1, status_idx + 1)[:-1]
+                ranges.append(f"{status_col}2:{status_col}{synced_count}")
+            results = sheet.batch_get(ranges)
+
+            # 마지막 동기화 행의 ID가 달라졌으면 행 삭제/이동이 있었던 것이므로 전체 재조회
+            tail = [list(row) for row in results[0]]
+            if not tail or (tail[0][:1] or ['']) != (synced[-1][:1] or ['']):
+                return self.full_sync()
+
+            all_values = list(synced)
+
+            if status_idx is not None and len(results) > 1:
+                status_values = results[1]
+                for i in range(1, synced_count):
+                    cells = status_values[i - 1] if i - 1 < len(status_values) else []
+                    new_status = cells[0] if cells else ''
+                    row = all_values[i]
+                    old_status = row[status_idx] if status_idx < len(row) else ''
+                    if new_status != old_status:
+                        row = list(row) + [''] * (len(headers) - len(row))
+                        row[status_idx] = new_status
+                        all_values[i] = row
+
+            for offset, row in enumerate(tail[1:], start=1):
+                row = row + [''] * (len(headers) - len(row))
+                all_values.append(row)
+                if row[0]:
+                    self.row_locator.add(row[0], synced_count + offset)
+            self.backend.ticket_allocator.observe(
+                *ticket_counters_from_values([headers] + all_values[synced_count:])
+            )
+
+            self._synced_values = all_values
+            return all_values
+
+    def load_counters(self):
+        """전체를 읽어 헤더를 점검하고 (최대 ID, 매장별 최대 티켓) 반환"""
+        sheet = self.sheet(create=True)
+        all_values = self.full_sync()
+        
+        # 헤더가 없으면 추가
+        if not all_values:
+            headers = list(CUSTOMER_HEADERS)
+            sheet.append_row(headers)
+            self._remember_full_read([headers])
+            return 0, {}
+        
+        # 헤더에 store_ticket_number 컬럼이 없으면 추가
+        headers = all_values[0]
+        if "store_ticket_number" not in headers:
+            headers.append("store_ticket_number")
+            sheet.update('A1:I1', [headers])
+
+        return ticket_counters_from_values(all_values)
+
+    def append_row(self, row):
+        response = self.sheet(create=True).append_row(row)
+        self.row_locator.add(row[0], _appended_row_number(response))
+        self.backend._bump_version(self.title)
+
+    def append_rows(self, rows):
+        """여러 행을 한 번의 요청으로 추가"""
+        response = self.sheet(create=True).append_rows(rows)
+        first_row_number = _appended_row_number(response)
+        for offset, row in enumerate(rows):
+            self.row_locator.add(row[0], first_row_number + offset if first_row_number else None)
+        self.backend._bump_version(self.title)
+
+    def update_status(self, customer_id, new_status, full_scan=True):
+        """고객 상태 변경 (이 시트에서 찾지 못하면 False)"""
+        return str(customer_id) in self.update_statuses({str(customer_id): new_status}, full_scan)
+
+    def update_statuses(self, statuses, full_scan=True):
+        """{고객 ID: 상태}를 한 번의 batch_update로 반영하고 찾은 고객 ID 집합 반환"""
+        sheet = self.sheet()
+        rows = {}
+
+        # 색인된 행이 아직 같은 고객인지 ID 셀만 한 번에 읽어 확인
+        status_col = self.row_locator.column('status')
+        indexed = {
+            customer_id: self.row_locator.get(customer_id) for customer_id in statuses
+            if self.row_locator.get(customer_id)
+        }
+        if indexed and status_col:
+            id_cells = sheet.batch_get([f"A{row_number}" for row_number in indexed.values()])
+            for (customer_id, row_number), cells in zip(indexed.items(), id_cells):
+                if cells and cells[0] and cells[0][0] == customer_id:
+                    rows[customer_id] = row_number
+
+        # 색인이 없거나 어긋난 고객이 있으면 전체를 읽어 다시 만듦
+        missing = [customer_id for customer_id in statuses if customer_id not in rows]
+        if missing and full_scan:
+            all_values = self.full_sync()
+            if all_values:
+                status_col = all_values[0].index('status') + 1
+                missing = set(missing)
+                for i, row in enumerate(all_values[1:], start=2):
+                    if row and row[0] in missing:
+                        rows[row[0]] = i
+
+        if not rows:
+            return set()
+
+        sheet.batch_update([
+            {"range": gspread.utils.rowcol_to_a1(row_number, status_col), "values": [[statuses[customer_id]]]}
+            for customer_id, row_number in rows.items()
+        ])
+        self.backend._bump_version(self.title)
+        return set(rows)
+
+    def archive(self, cutoff, statuses, partition="month"):
+        """보관 대상 행을 보관 시트로 옮기고 지움 (이동한 행 수 반환)"""
+        sheet = self.sheet()
+
+        with self._sync_lock:
+            all_values = sheet.get_all_values()
+            if len(all_values) < 2:
+                return 0
+
+            headers = all_values[0]
+            status_idx = headers.index("status")
+            time_idx = headers.index("registered_time")
+            rows = all_values[1:]
+            registered_times = parse_registered_times([row[time_idx] if len(row) > time_idx else '' for row in rows])
+
+            partitions = {}
+            archived_row_numbers = []
+            for row_number, (row, registered_time) in enumerate(zip(rows, registered_times), start=2):
+                status = (row[status_idx] if len(row) > status_idx else '') or '대기'
+                # 등록 시간을 알 수 없는 행은 보관하지 않음
+                if status in statuses and not pd.isna(registered_time) and registered_time < cutoff:
+                    partitions.setdefault(archive_partition_name(registered_time, partition), []).append(row)
+                    archived_row_numbers.append(row_number)
+
+            if not archived_row_numbers:
+                return 0
+
+            self.backend._save_counters(*ticket_counters_from_values(all_values))
+
+            for title, partition_rows in sorted(partitions.items()):
+                self.backend._archive_sheet(title, headers).append_rows(partition_rows)
+
+            delete_row_blocks(self.backend.workbook, sheet, archived_row_numbers)
+
+            # 행 번호가 바뀌었으므로 다음 조회는 전체를 다시 읽음
+            self.forget()
+            self.backend._bump_version(self.title)
+            return len(archived_row_numbers)
+
+CUSTOMER_SHEET_PREFIX = "customers_"
+
+class GoogleSheetsBackend(StorageBackend):
+    """Google Sheets 저장소
+
+    layout이 "single"이면 모든 고객을 customers 시트 하나에 저장하고,
+    "store"/"team"이면 매장(또는 팀)별 customers_<코드> 시트에 나눠 저장해
+    한 매장의 조회가 다른 매장의 대기열을 내려받지 않게 합니다.
+
+    고객 시트에 쓸 때마다 versions 시트에 시트별 변경 토큰을 기록하므로,
+    조회 전에 이 작은 시트만 읽어 변경이 없으면 고객 시트 조회를 건너뛸 수 있습니다.
+    """
+
+    # 팀 분할 저장에서 매장 목록에 없는 매장 코드를 다시 확인하기까지의 시간 (초)
+    UNKNOWN_STORE_RETRY_SECONDS = 60
+
+    def __init__(self, workbook, incremental_sync=True, full_sync_interval=600, layout="single"):
+        self.workbook = workbook
+        self.incremental_sync = incremental_sync
+        self.full_sync_interval = full_sync_interval
+        self.layout = layout
+        self.supports_store_filter = layout != "single"
+        self._worksheets = {}
+        self._customer_sheets = {}
+        self._customer_sheets_lock = threading.Lock()
+        self._store_teams = {}
+        self._unknown_store_retry_at = {}
+        self._shard_titles = None
+        self.supports_deferred_add = True
+        self._version_rows = None
+        self._version_lock = threading.Lock()
+        self._unbumped_titles = set()
+        self._ticket_stats_rows = None
+        self.ticket_allocator = TicketAllocator(self._load_ticket_counters)
+
+    def _worksheet(self, title):
+        """워크시트 핸들 재사용 (worksheet() 호출마다 메타데이터 요청이 발생함)"""
+        sheet = self._worksheets.get(title)
+        if sheet is None:
+            sheet = self.workbook.worksheet(title)
+            self._worksheets[title] = sheet
+        return sheet
+
+    def _customer_sheet_by_title(self, title):
+        with self._customer_sheets_lock:
+            customer_sheet = self._customer_sheets.get(title)
+            if customer_sheet is None:
+                customer_sheet = CustomerSheet(self, title)
+                self._customer_sheets[title] = customer_sheet
+                if self._shard_titles is not None and title not in self._shard_titles:
+                    self._shard_titles.append(title)
+            return customer_sheet
+
+    def customer_sheet_title(self, store_code):
+        """매장 코드가 저장되는 고객 시트 이름"""
+        if self.layout == "store":
+            return CUSTOMER_SHEET_PREFIX + str(store_code)
+        if self.layout == "team":
+            team = self._store_teams.get(store_code)
+            retry_at = self._unknown_store_retry_at.get(store_code)
+            if team is None and (retry_at is None or time.monotonic() >= retry_at):
+                # 새 매장이면 매장 목록을 다시 읽음
+                values = self.get_store_values()
+                if values:
+                    headers = values[0]
+                    code_idx, team_idx = headers.index("store_code"), headers.index("team")
+                    self._store_teams = {
+                        row[code_idx]: row[team_idx] for row in values[1:] if len(row) > max(code_idx, team_idx)
+                    }
+                team = self._store_teams.get(store_code)
+                if team is None:
+                    # 목록에 없는 매장은 잠시 기본 시트를 쓰고, 호출마다 매장 목록을 다시 읽지 않음
+                    self._unknown_store_retry_at[store_code] = time.monotonic() + self.UNKNOWN_STORE_RETRY_SECONDS
+            return CUSTOMER_SHEET_PREFIX + (team or str(store_code))
+        return "customers"
+
+    def _customer_sheet(self, store_code):
+        return self._customer_sheet_by_title(self.customer_sheet_title(store_code))
+
+    def _all_customer_sheets(self):
+        """고객 시트 전체 (분할 저장이면 customers_로 시작하는 시트, 보관 시트 제외)"""
+        if self.layout == "single":
+            return [self._customer_sheet_by_title("customers")]
+
+        if self._shard_titles is None:
+            self._shard_titles = [
+                sheet.title for sheet in self.workbook.worksheets()
+                if sheet.title.startswith(CUSTOMER_SHEET_PREFIX) and not sheet.title.startswith("customers_archive_")
+            ]
+        return [self._customer_sheet_by_title(title) for title in list(self._shard_titles)]
+
+    def get_store_values(self):
+        return self._worksheet("stores").get_all_values()
+
+    def get_customer_values(self, store_code=None):
+        if store_code and self.layout != "single":
+            try:
+                return self._customer_sheet(store_code).read_values()
+            except gspread.exceptions.WorksheetNotFound:
+                return [list(CUSTOMER_HEADERS)]
+
+        # 전체 조회: 모든 고객 시트를 헤더 하나로 합침
+        combined = []
+        for customer_sheet in self._all_customer_sheets():
+            values = customer_sheet.read_values()
+            if not values:
+                continue
+            if not combined:
+                combined = [list(values[0])]
+            width = len(combined[0])
+            combined.extend(row + [''] * (width - len(row)) for row in values[1:])
+        return combined
+
+    def get_settings_values(self):
+        return self._worksheet("settings").get_all_values()
+
+    def _read_versions(self):
+        """versions 시트의 {고객 시트 이름: 변경 토큰}"""
+        try:
+            rows = self._worksheet("versions").get_all_values()
+        except gspread.exceptions.WorksheetNotFound:
+            return {}
+
+        versions = {}
+        version_rows = {}
+        for row_number, row in enumerate(rows, start=1):
+            if row and row[0]:
+                # 같은 시트가 여러 줄이면 첫 줄만 사용 (기록도 첫 줄에 함)
+                version_rows.setdefault(row[0], row_number)
+                versions.setdefault(row[0], row[1] if len(row) > 1 else '')
+        self._version_rows = version_rows
+        return versions
+
+    def _bump_version(self, title):
+        """고객 시트가 바뀌었음을 versions 시트에 기록 (실패해도 쓰기 자체는 유지)
+
+        고객 시트 쓰기(행 추가, 상태 변경 묶음, 보관)마다 Sheets 쓰기 요청이 1회 더 들어가므로
+        분당 쓰기 할당량에는 고객 쓰기 요청의 두 배로 계산해야 합니다. 대신 조회 쪽은 변경이 없으면
+        고객 시트 대신 이 작은 시트만 읽습니다. 기록에 실패한 시트는 다음 버전 조회 때 다시 기록합니다.
+        """
+        token = format(time.time_ns(), "x")
+        try:
+            with self._version_lock:
+                try:
+                    sheet = self._worksheet("versions")
+                except gspread.exceptions.WorksheetNotFound:
+                    sheet = self.workbook.add_worksheet(title="versions", rows="100", cols="2")
+                    self._worksheets["versions"] = sheet
+                    self._version_rows = {}
+
+                if self._version_rows is None:
+                    self._read_versions()
+                row_number = self._version_rows.get(title)
+                if row_number:
+                    sheet.update_cell(row_number, 2, token)
+                else:
+                    row_number = _appended_row_number(sheet.append_row([title, token]))
+                    if row_number:
+                        self._version_rows[title] = row_number
+                    else:
+                        self._version_rows = None
+                self._unbumped_titles.discard(title)
+        except Exception:
+            # 다른 프로세스가 변경을 놓치지 않도록 기록되지 않은 시트를 기억해 둠
+            with self._version_lock:
+                self._unbumped_titles.add(title)
+
+    def get_customer_version(self, store_code=None):
+        if store_code and self.layout != "single":
+            customer_sheets = [self._customer_sheet(store_code)]
+        else:
+            customer_sheets = self._all_customer_sheets()
+
+        # 전체 재조회 주기가 되면 토큰과 관계없이 다시 읽도록 버전을 모르는 것으로 처리
+        if any(customer_sheet.full_sync_due() for customer_sheet in customer_sheets):
+            return None
+
+        with self._version_lock:
+            unbumped_titles = list(self._unbumped_titles)
+        for title in unbumped_titles:
+            self._bump_version(title)
+        versions = self._read_versions()
+        # versions 시트나 시트별 토큰이 없으면(아직 기록 전이거나 기록 실패) 변경 여부를 알 수 없음
+        if any(not versions.get(customer_sheet.title) for customer_sheet in customer_sheets):
+            return None
+        if any(customer_sheet.title in self._unbumped_titles for customer_sheet in customer_sheets):
+            return None
+        return "|".join(versions[customer_sheet.title] for customer_sheet in customer_sheets)
+
+    def _load_ticket_counters(self):
+        """고객 시트에서 현재 최대 ID와 매장별 최대 티켓 번호 조회 (발급기 초기화용)"""
+        customer_sheets = self._all_customer_sheets()
+        counters = [customer_sheet.load_counters() for customer_sheet in customer_sheets]
+        
+        # 보관 시트로 옮겨진 번호도 이어서 발급되도록 counters 시트와 합침
+        return merge_ticket_counters(*counters, self._load_saved_counters())
+
+    def _load_saved_counters(self):
+        """counters 시트에 저장된 최대 ID/매장별 티켓 번호"""
+        try:
+            rows = self._worksheet("counters").get_all_values()[1:]
+        except gspread.exceptions.WorksheetNotFound:
+            return 0, {}
+
+        max_id = 0
+        max_tickets = {}
+        for row in rows:
+            if len(row) < 2 or not row[1].isdigit():
+                continue
+            if row[0] == LAST_ID_COUNTER_KEY:
+                max_id = int(row[1])
+            elif row[0]:
+                max_tickets[row[0]] = int(row[1])
+        return max_id, max_tickets
+
+    def _save_counters(self, max_id, max_tickets):
+        """최대 ID/매장별 티켓 번호를 counters 시트에 저장 (기존 값보다 작아지지 않음)"""
+        max_id, max_tickets = merge_ticket_counters((max_id, max_tickets), self._load_saved_counters())
+        try:
+            sheet = self._worksheet("counters")
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = self.workbook.add_worksheet(title="counters", rows="100", cols="2")
+            self._worksheets["counters"] = sheet
+
+        rows = [["key", "value"], [LAST_ID_COUNTER_KEY, str(max_id)]]
+        rows += [[store_code, str(ticket)] for store_code, ticket in sorted(max_tickets.items())]
+        sheet.update(f"A1:B{len(rows)}", rows)
+
+    def get_ticket_stats_values(self):
+        try:
+            values = self._worksheet("ticket_stats").get_all_values()
+        except gspread.exceptions.WorksheetNotFound:
+            return None
+        self._ticket_stats_rows = {
+            tuple(row[:4]): row_number for row_number, row in enumerate(values[1:], start=2) if len(row) >= 4
+        }
+        return values
+
+    def save_ticket_stats(self, rows):
+        try:
+            sheet = self._worksheet("ticket_stats")
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = self.workbook.add_worksheet(title="ticket_stats", rows="1000", cols=str(len(TICKET_STATS_HEADERS)))
+            sheet.append_row(TICKET_STATS_HEADERS)
+            self._worksheets["ticket_stats"] = sheet
+            self._ticket_stats_rows = {}
+        if self._ticket_stats_rows is None:
+            self.get_ticket_stats_values()
+
+        # 이미 있는 칸은 한 번의 batch_update로 덮어쓰고, 새 칸은 한 번에 추가
+        last_col = gspread.utils.rowcol_to_a1(1, len(TICKET_STATS_HEADERS))[:-1]
+        updates = []
+        new_rows = []
+        for row in rows:
+            row_number = self._ticket_stats_rows.get(tuple(row[:4]))
+            if row_number:
+                updates.append({"range": f"A{row_number}:{last_col}{row_number}", "values": [row]})
+            else:
+                new_rows.append(row)
+        if updates:
+            sheet.batch_update(updates)
+        if new_rows:
+            first_row_number = _appended_row_number(sheet.append_rows(new_rows))
+            if first_row_number:
+                for offset, row in enumerate(new_rows):
+                    self._ticket_stats_rows[tuple(row[:4])] = first_row_number + offset
+            else:
+                # 추가된 위치를 알 수 없으면 다음 저장 전에 다시 읽음
+                self._ticket_stats_rows = None
+
+    def get_status_event_values(self):
+        try:
+            return self._worksheet("status_events").get_all_values()
+        except gspread.exceptions.WorksheetNotFound:
+            return None
+
+    def append_status_events(self, rows):
+        try:
+            sheet = self._worksheet("status_events")
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = self.workbook.add_worksheet(title="status_events", rows="1000", cols=str(len(STATUS_EVENT_HEADERS)))
+            sheet.append_row(STATUS_EVENT_HEADERS)
+            self._worksheets["status_events"] = sheet
+        sheet.append_rows(rows)
+
+    def archive_status_events(self, cutoff, partition="month"):
+        try:
+            sheet = self._worksheet("status_events")
+        except gspread.exceptions.WorksheetNotFound:
+            return 0
+
+        all_values = sheet.get_all_values()
+        if len(all_values) < 2:
+            return 0
+        time_idx = all_values[0].index("event_time")
+        cutoff_text = cutoff.strftime(STATUS_EVENT_TIME_FORMAT)
+
+        partitions = {}
+        archived_row_numbers = []
+        for row_number, row in enumerate(all_values[1:], start=2):
+            event_time = row[time_idx] if len(row) > time_idx else ''
+            # 고정 형식이므로 문자열 비교로 충분, 시각이 없는 행은 보관하지 않음
+            if event_time and event_time < cutoff_text:
+                event_date = datetime.strptime(event_time, STATUS_EVENT_TIME_FORMAT)
+                title = archive_partition_name(event_date, partition, STATUS_EVENT_ARCHIVE_PREFIX)
+                partitions.setdefault(title, []).append(row)
+                archived_row_numbers.append(row_number)
+        if not archived_row_numbers:
+            return 0
+
+        for title, partition_rows in sorted(partitions.items()):
+            self._archive_sheet(title, all_values[0]).append_rows(partition_rows)
+        delete_row_blocks(self.workbook, sheet, archived_row_numbers)
+        return len(archived_row_numbers)
+
+    def _archive_sheet(self, title, headers):
+        try:
+            return self._worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            sheet = self.workbook.add_worksheet(title=title, rows="1000", cols=str(len(headers)))
+            sheet.append_row(headers)
+            self._worksheets[title] = sheet
+            return sheet
+
+    def archive_customers(self, cutoff, statuses, partition="month"):
+        return sum(
+            customer_sheet.archive(cutoff, statuses, partition)
+            for customer_sheet in self._all_customer_sheets()
+        )
+
+    def add_customer(self, name, phone, service_type, store_code, registered_time, estimated_time):
+        new_row = self.prepare_customer(name, phone, service_type, store_code, registered_time, estimated_time)
+        
+        # 행 추가 (실패하면 발급한 번호는 건너뛰며 재사용하지 않음)
+        self.append_customer_row(new_row)
+        return int(new_row[0]), int(new_row[8])
+
+    def prepare_customer(self, name, phone, service_type, store_code, registered_time, estimated_time):
+        new_id, store_ticket_number = self.ticket_allocator.allocate(store_code)
+        
+        # 새 행 데이터 준비
+        return [
+            str(new_id),
+            str(name),
+            str(phone),
+            str(service_type),
+            registered_time,
+            "대기",
+            str(store_code),
+            str(estimated_time),
+            str(store_ticket_number)
+        ]
+
+    def peek_next_ticket(self, store_code):
+        return self.ticket_allocator.peek(store_code)
+
+    def append_customer_row(self, row):
+        """이미 번호가 정해진 고객 행 추가 (미러링/비동기 등록용)"""
+        self._customer_sheet(row[6]).append_row(row)
+
+    def customer_row_group(self, row):
+        # 같은 고객 시트에 들어갈 행끼리 묶음
+        return self.customer_sheet_title(row[6])
+
+    def append_customer_rows(self, rows):
+        self._customer_sheet(rows[0][6]).append_rows(rows)
+
+    def update_customer_status(self, customer_id, new_status, store_code=None):
+        if store_code:
+            return self._customer_sheet(store_code).update_status(customer_id, new_status)
+
+        customer_sheets = self._all_customer_sheets()
+        if len(customer_sheets) == 1:
+            return customer_sheets[0].update_status(customer_id, new_status)
+
+        # 매장을 모르면 색인으로 먼저 찾고, 없으면 시트를 하나씩 전체 조회
+        for customer_sheet in customer_sheets:
+            if customer_sheet.update_status(customer_id, new_status, full_scan=False):
+                return True
+        for customer_sheet in customer_sheets:
+            if customer_sheet.update_status(customer_id, new_status):
+                return True
+        return False
+
+    def update_customer_statuses(self, updates):
+        updated = set()
+        by_sheet = {}
+        for customer_id, new_status, store_code in updates:
+            if store_code or self.layout == "single":
+                title = self.customer_sheet_title(store_code)
+                by_sheet.setdefault(title, {})[str(customer_id)] = new_status
+            elif self.update_customer_status(customer_id, new_status):
+                # 분할 저장인데 매장을 모르면 기존 방식으로 찾음
+                updated.add(str(customer_id))
+
+        for title, statuses in by_sheet.items():
+            updated |= self._customer_sheet_by_title(title).update_statuses(statuses)
+        return updated
+
+    def split_customers(self):
+        """기존 customers 시트의 고객을 매장(팀)별 시트로 복사 (시트별 복사한 행 수 반환)
+
+        이미 옮겨진 ID는 건너뛰므로 여러 번 실행해도 안전합니다. 원본 시트는 그대로 둡니다.
+        """
+        if self.layout == "single":
+            raise ValueError("layout이 store 또는 team일 때만 분할할 수 있습니다.")
+
+        all_values = self._worksheet("customers").get_all_values()
+        if len(all_values) < 2:
+            return {}
+
+        headers = all_values[0]
+        store_idx = headers.index("store_code")
+        self._save_counters(*ticket_counters_from_values(all_values))
+
+        grouped = {}
+        for row in all_values[1:]:
+            if not row or not row[0]:
+                continue
+            store_code = row[store_idx] if len(row) > store_idx else ''
+            grouped.setdefault(self.customer_sheet_title(store_code or "UNKNOWN"), []).append(row)
+
+        copied = {}
+        for title, rows in grouped.items():
+            customer_sheet = self._customer_sheet_by_title(title)
+            customer_sheet.sheet(create=True)
+            existing_ids = {row[0] for row in customer_sheet.full_sync()[1:] if row}
+            new_rows = [row for row in rows if row[0] not in existing_ids]
+            if new_rows:
+                customer_sheet.sheet().append_rows(new_rows)
+                customer_sheet.forget()
+                self._bump_version(title)
+            copied[title] = len(new_rows)
+
+        self.ticket_allocator.reset()
+        return copied
+
+    def set_store_admin(self, store_name, admin_id, admin_pw):
+        sheet = self._worksheet("stores")
+        all_values = sheet.get_all_values()
+        headers = all_values[0]
+        
+        try:
+            store_name_idx = headers.index("store_name")
+            admin_id_idx = headers.index("admin_id")
+            admin_pw_idx = headers.index("admin_pw")
+        except ValueError:
+            return False
+            
+        for i, row in enumerate(all_values[1:], start=2):
+            if row[store_name_idx] == store_name:
+                # 두 셀을 한 번의 요청으로 수정
+                sheet.batch_update([
+                    {"range": gspread.utils.rowcol_to_a1(i, admin_id_idx + 1), "values": [[admin_id]]},
+                    {"range": gspread.utils.rowcol_to_a1(i, admin_pw_idx + 1), "values": [[admin_pw]]},
+                ])
+                return True
+        return False
+
+class SQLiteBackend(StorageBackend):
+    """로컬 SQLite 저장소
+
+    store_code, status, phone, id에 인덱스가 있어 대기열 조회가 밀리초 단위로 끝납니다.
+    mirror에 GoogleSheetsBackend를 넘기면 최초 실행 시 시트 데이터를 가져오고,
+    이후 쓰기를 시트에도 반영합니다 (미러 실패는 등록을 막지 않음).
+    미러 없이 쓸 때는 seed()로 매장/설정을 채웁니다 (python Home.py import-sqlite).
+    """
+
+    supports_store_filter = True
+
+    def __init__(self, path, mirror=None):
+        self.path = path
+        self.mirror = mirror
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create_schema()
+        if mirror is not None:
+            self._seed_from_mirror()
+
+    def _create_schema(self):
+        with self._lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS stores (
+                    store_code TEXT PRIMARY KEY,
+                    store_name TEXT NOT NULL,
+                    team TEXT DEFAULT '',
+                    admin_id TEXT DEFAULT '',
+                    admin_pw TEXT DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS idx_stores_store_name ON stores(store_name);
+                CREATE TABLE IF NOT EXISTS customers (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    phone TEXT,
+                    service_type TEXT,
+                    registered_time TEXT,
+                    status TEXT DEFAULT '대기',
+                    store_code TEXT,
+                    estimated_time TEXT,
+                    store_ticket_number INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_customers_store_code ON customers(store_code, store_ticket_number);
+                CREATE INDEX IF NOT EXISTS idx_customers_status ON customers(status);
+                CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone);
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS counters (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS ticket_stats (
+                    date TEXT,
+                    store_code TEXT,
+                    hour INTEGER,
+                    service_type TEXT,
+                    issued INTEGER DEFAULT 0,
+                    completed INTEGER DEFAULT 0,
+                    PRIMARY KEY (date, store_code, hour, service_type)
+                );
+                CREATE TABLE IF NOT EXISTS status_events (
+                    customer_id TEXT,
+                    store_code TEXT,
+                    service_type TEXT,
+                    registered_time TEXT,
+                    status TEXT,
+                    event_time TEXT,
+                    admin_id TEXT,
+                    counter TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_status_events_store ON status_events(store_code, event_time);
+            """)
+
+    def _seed_from_mirror(self):
+        """비어 있는 테이블을 Google Sheets 데이터로 채움"""
+        try:
+            self.seed(self.mirror.get_store_values, self.mirror.get_settings_values, self.mirror.get_customer_values)
+        except gspread.exceptions.WorksheetNotFound:
+            pass
+
+    def has_stores(self):
+        """매장이 하나라도 등록되어 있는지 여부"""
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM stores").fetchone()[0] > 0
+
+    def seed(self, load_store_values=None, load_settings_values=None, load_customer_values=None):
+        """비어 있는 테이블만 get_all_values() 형식 값으로 채움 (load_*는 값을 반환하는 함수, 채운 테이블 이름 목록 반환)"""
+        def _rows_as_dicts(values):
+            if not values or len(values) < 2:
+                return []
+            headers = values[0]
+            return [dict(zip(headers, row + [''] * (len(headers) - len(row)))) for row in values[1:]]
+
+        def _is_empty(table):
+            return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
+
+        seeded = []
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if load_store_values is not None and _is_empty("stores"):
+                    for store in _rows_as_dicts(load_store_values()):
+                        if store.get('store_code') and store.get('store_name'):
+                            self.conn.execute(
+                                "INSERT OR IGNORE INTO stores VALUES (?, ?, ?, ?, ?)",
+                                [store.get(h, '') for h in STORE_HEADERS]
+                            )
+                    seeded.append("stores")
+                if load_settings_values is not None and _is_empty("settings"):
+                    for row in load_settings_values()[1:]:
+                        if len(row) >= 2 and row[0]:
+                            self.conn.execute("INSERT OR IGNORE INTO settings VALUES (?, ?)", (row[0], row[1]))
+                    seeded.append("settings")
+                if load_customer_values is not None and _is_empty("customers"):
+                    for customer in _rows_as_dicts(load_customer_values()):
+                        if not str(customer.get('id', '')).isdigit():
+                            continue
+                        ticket = customer.get('store_ticket_number', '')
+                        self.conn.execute(
+                            "INSERT OR IGNORE INTO customers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            [int(customer['id'])] + [customer.get(h, '') for h in CUSTOMER_HEADERS[1:-1]]
+                            + [int(ticket) if str(ticket).isdigit() else 0]
+                        )
+                    seeded.append("customers")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return seeded
+
+    def _values(self, headers, rows):
+        return [list(headers)] + [['' if v is None else str(v) for v in row] for row in rows]
+
+    def get_store_values(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT store_code, store_name, team, admin_id, admin_pw FROM stores").fetchall()
+        return self._values(STORE_HEADERS, rows)
+
+    def get_customer_values(self, store_code=None):
+        query = f"SELECT {', '.join(CUSTOMER_HEADERS)} FROM customers"
+        params = ()
+        if store_code:
+            query += " WHERE store_code = ?"
+            params = (store_code,)
+        with self._lock:
+            rows = self.conn.execute(query + " ORDER BY id", params).fetchall()
+        return self._values(CUSTOMER_HEADERS, rows)
+
+    def get_settings_values(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT key, value FROM settings").fetchall()
+        return self._values(["key", "value"], rows)
+
+    def add_customer(self, name, phone, service_type, store_code, registered_time, estimated_time):
+        with self._lock:
+            # BEGIN IMMEDIATE로 같은 DB 파일을 쓰는 다른 프로세스와도 번호가 겹치지 않게 함
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                new_id = max(
+                    self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM customers").fetchone()[0],
+                    self._saved_counter(LAST_ID_COUNTER_KEY)
+                ) + 1
+                store_ticket_number = self._next_ticket(store_code)
+                new_row = [new_id, str(name), str(phone), str(service_type), registered_time,
+                           "대기", str(store_code), str(estimated_time), store_ticket_number]
+                self.conn.execute("INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", new_row)
+                self._bump_version()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        if self.mirror is not None:
+            try:
+                self.mirror.append_customer_row([str(v) for v in new_row])
+            except Exception:
+                pass
+        return new_id, store_ticket_number
+
+    def _saved_counter(self, key):
+        """보관 시 저장한 카운터 값 (없으면 0)"""
+        row = self.conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self):
+        """고객 데이터 변경 토큰 증가 (쓰기와 같은 트랜잭션에서 호출)"""
+        self.conn.execute(
+            "INSERT INTO counters VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1",
+            (CUSTOMER_VERSION_COUNTER_KEY,)
+        )
+
+    def get_customer_version(self, store_code=None):
+        with self._lock:
+            return str(self._saved_counter(CUSTOMER_VERSION_COUNTER_KEY))
+
+    def _next_ticket(self, store_code):
+        current = self.conn.execute(
+            "SELECT COALESCE(MAX(store_ticket_number), 0) FROM customers WHERE store_code = ?",
+            (store_code,)
+        ).fetchone()[0]
+        return max(current, self._saved_counter(store_code)) + 1
+
+    def peek_next_ticket(self, store_code):
+        with self._lock:
+            return self._next_ticket(store_code)
+
+    def archive_customers(self, cutoff, statuses, partition="month"):
+        columns = ', '.join(CUSTOMER_HEADERS)
+        placeholders = ', '.join('?' for _ in statuses)
+
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                candidates = self.conn.execute(
+                    f"SELECT {columns} FROM customers WHERE COALESCE(NULLIF(status, ''), '대기') IN ({placeholders})",
+                    tuple(statuses)
+                ).fetchall()
+                registered_times = parse_registered_times([row[4] for row in candidates])
+
+                partitions = {}
+                for row, registered_time in zip(candidates, registered_times):
+                    if not pd.isna(registered_time) and registered_time < cutoff:
+                        partitions.setdefault(archive_partition_name(registered_time, partition), []).append(row)
+
+                if not partitions:
+                    self.conn.execute("COMMIT")
+                    return 0
+
+                # 보관으로 빠지는 번호도 이어서 발급되도록 현재 최댓값 저장
+                self.conn.execute(
+                    "INSERT INTO counters SELECT ?, MAX(id) FROM customers WHERE true "
+                    "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                    (LAST_ID_COUNTER_KEY,)
+                )
+                self.conn.execute(
+                    "INSERT INTO counters SELECT store_code, COALESCE(MAX(store_ticket_number), 0) FROM customers "
+                    "WHERE store_code IS NOT NULL GROUP BY store_code "
+                    "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)"
+                )
+
+                archived = 0
+                for table_name, rows in partitions.items():
+                    self.conn.execute(
+                        f'CREATE TABLE IF NOT EXISTS "{table_name}" AS SELECT * FROM customers WHERE 0'
+                    )
+                    self.conn.executemany(
+                        f'INSERT OR REPLACE INTO "{table_name}" ({columns}) VALUES ({", ".join("?" for _ in CUSTOMER_HEADERS)})',
+                        rows
+                    )
+                    self.conn.executemany("DELETE FROM customers WHERE id = ?", [(row[0],) for row in rows])
+                    archived += len(rows)
+                self._bump_version()
+                self.conn.execute("COMMIT")
+                return archived
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def update_customer_status(self, customer_id, new_status, store_code=None):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self.conn.execute(
+                    "UPDATE customers SET status = ? WHERE id = ?", (new_status, int(customer_id))
+                ).rowcount > 0
+                if updated:
+                    self._bump_version()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        if updated and self.mirror is not None:
+            try:
+                self.mirror.update_customer_status(customer_id, new_status, store_code)
+            except Exception:
+                pass
+        return updated
+
+    def get_ticket_stats_values(self):
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {', '.join(TICKET_STATS_HEADERS)} FROM ticket_stats").fetchall()
+        return self._values(TICKET_STATS_HEADERS, rows)
+
+    def save_ticket_stats(self, rows):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO ticket_stats VALUES (?, ?, ?, ?, ?, ?)",
+                    [(row[0], row[1], int(row[2]), row[3], int(row[4]), int(row[5])) for row in rows]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_status_event_values(self):
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(STATUS_EVENT_HEADERS)} FROM status_events ORDER BY rowid"
+            ).fetchall()
+        return self._values(STATUS_EVENT_HEADERS, rows)
+
+    def append_status_events(self, rows):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("INSERT INTO status_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def archive_status_events(self, cutoff, partition="month"):
+        columns = ', '.join(STATUS_EVENT_HEADERS)
+        cutoff_text = cutoff.strftime(STATUS_EVENT_TIME_FORMAT)
+
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    f"SELECT {columns} FROM status_events WHERE event_time != '' AND event_time < ?",
+                    (cutoff_text,)
+                ).fetchall()
+                partitions = {}
+                for row in rows:
+                    event_date = datetime.strptime(row[5], STATUS_EVENT_TIME_FORMAT)
+                    title = archive_partition_name(event_date, partition, STATUS_EVENT_ARCHIVE_PREFIX)
+                    partitions.setdefault(title, []).append(row)
+
+                for table_name, partition_rows in partitions.items():
+                    self.conn.execute(
+                        f'CREATE TABLE IF NOT EXISTS "{table_name}" AS SELECT * FROM status_events WHERE 0'
+                    )
+                    self.conn.executemany(
+                        f'INSERT INTO "{table_name}" ({columns}) VALUES ({", ".join("?" for _ in STATUS_EVENT_HEADERS)})',
+                        partition_rows
+                    )
+                self.conn.execute(
+                    "DELETE FROM status_events WHERE event_time != '' AND event_time < ?", (cutoff_text,)
+                )
+                self.conn.execute("COMMIT")
+                return len(rows)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def set_store_admin(self, store_name, admin_id, admin_pw):
+        with self._lock:
+            updated = self.conn.execute(
+                "UPDATE stores SET admin_id = ?, admin_pw = ? WHERE store_name = ?",
+                (admin_id, admin_pw, store_name)
+            ).rowcount > 0
+
+        if updated and self.mirror is not None:
+            try:
+                self.mirror.set_store_admin(store_name, admin_id, admin_pw)
+            except Exception:
+                pass
+        return updated
+
+# 비동기 등록 파이프라인
+class RegistrationPipeline:
+    """고객 행 저장을 백그라운드에서 처리하는 등록 파이프라인
+
+    번호는 백엔드가 로컬에서 바로 발급하고(prepare_customer), 행 저장은 작업 스레드가 등록 순서대로 처리합니다.
+    batch_window초 동안 들어온 등록은 모아서 저장 단위(시트)별로 한 번에 추가하므로,
+    몰리는 시간대에도 쓰기 요청 수는 등록 수가 아니라 묶음 수만큼만 늘어납니다.
+
+    blocking이 False면 저장에 실패해도 간격을 늘려 가며 계속 재시도하고, 저장 전인 행은 pending_rows()로 조회됩니다.
+    blocking이 True면 호출한 쪽이 submit()이 반환한 Future로 저장 완료를 기다리며,
+    max_attempts번 실패하면 해당 등록은 취소됩니다.
+    저장 전에 바뀐 상태는 저장 후 이어서 반영합니다. 프로세스가 종료되면 저장 전인 행은 사라집니다.
+    """
+
+    def __init__(self, backend, batch_window=0.3, blocking=False, max_attempts=3, retry_delay=1, max_retry_delay=60):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.blocking = blocking
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._saved_status = {}
+        self._futures = {}
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="registration-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, row):
+        """저장할 고객 행 등록 (바로 반환, Future는 저장이 끝나면 완료됨)"""
+        future = Future()
+        with self._lock:
+            self._pending[row[0]] = list(row)
+            self._futures[row[0]] = future
+        self._queue.put(row[0])
+        return future
+
+    def pending_rows(self, store_code=None):
+        """아직 저장되지 않은 고객 행 (현재 상태 반영)"""
+        with self._lock:
+            return [
+                list(row) for row in self._pending.values()
+                if not store_code or row[6] == str(store_code)
+            ]
+
+    def update_status(self, customer_id, new_status):
+        """저장 대기 중인 고객이면 상태를 바꾸고 True 반환"""
+        with self._lock:
+            row = self._pending.get(str(customer_id))
+            if row is None:
+                return False
+            row[5] = new_status
+            return True
+
+    def _collect_batch(self):
+        """첫 등록 후 batch_window초 동안 들어온 등록을 함께 모음"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _append_rows(self, customer_ids):
+        """아직 추가하지 않은 행을 저장 단위별로 한 번에 추가"""
+        with self._lock:
+            rows = [list(self._pending[customer_id]) for customer_id in customer_ids
+                    if customer_id not in self._saved_status]
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.backend.customer_row_group(row), []).append(row)
+        for group_rows in groups.values():
+            self.backend.append_customer_rows(group_rows)
+            with self._lock:
+                for row in group_rows:
+                    self._saved_status[row[0]] = row[5]
+
+    def _sync_status(self, customer_id):
+        """저장 전에 바뀐 상태를 저장된 행에 반영"""
+        while True:
+            with self._lock:
+                row = list(self._pending[customer_id])
+                saved_status = self._saved_status[customer_id]
+            if row[5] == saved_status:
+                return
+            if not self.backend.update_customer_status(customer_id, row[5], row[6]):
+                raise RuntimeError(f"고객 {customer_id} 상태 반영 실패")
+            with self._lock:
+                self._saved_status[customer_id] = row[5]
+
+    def _finish(self, customer_ids):
+        """저장이 끝난 행을 대기 목록에서 빼고, 그 사이 상태가 또 바뀐 행 ID 반환"""
+        # 캐시를 먼저 비워야 저장된 행이 조회 결과에서 잠시 빠지지 않음
+        get_backend_cache(self.backend, "customer").invalidate()
+        done = []
+        remaining = []
+        with self._lock:
+            for customer_id in customer_ids:
+                if self._pending[customer_id][5] != self._saved_status[customer_id]:
+                    remaining.append(customer_id)
+                    continue
+                del self._pending[customer_id]
+                del self._saved_status[customer_id]
+                done.append(self._futures.pop(customer_id))
+        for future in done:
+            future.set_result(True)
+        return remaining
+
+    def _fail(self, customer_ids, error):
+        """재시도 횟수를 넘긴 등록 취소 (이미 추가된 행은 저장된 것으로 처리)"""
+        get_backend_cache(self.backend, "customer").invalidate()
+        results = []
+        with self._lock:
+            for customer_id in customer_ids:
+                saved = self._saved_status.pop(customer_id, None) is not None
+                del self._pending[customer_id]
+                results.append((self._futures.pop(customer_id), saved))
+        for future, saved in results:
+            if saved:
+                future.set_result(True)
+            else:
+                future.set_exception(error)
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            delay = self.retry_delay
+            attempts = 0
+            while batch:
+                try:
+                    self._append_rows(batch)
+                    for customer_id in batch:
+                        self._sync_status(customer_id)
+                    batch = self._finish(batch)
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    attempts += 1
+                    if self.blocking and attempts >= self.max_attempts:
+                        self._fail(batch, e)
+                        break
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+
+class StatusWriteQueue:
+    """고객 상태 변경을 모아서 저장하는 쓰기 지연(write-behind) 큐
+
+    변경은 바로 overrides()에 반영되어 조회 결과에 보이고, 작업 스레드가
+    flush_interval초 동안 모인 변경을 시트별 batch_update 한 번으로 저장합니다.
+    같은 고객의 상태가 여러 번 바뀌면 마지막 상태만 저장합니다.
+    저장에 실패하면 간격을 늘려 가며 재시도하며, 프로세스가 종료되면 저장 전인 변경은 사라집니다.
+    submit()의 on_saved는 시트 저장이 확인된 뒤에만 실행되고, 시트에서 고객을 찾지 못한 변경은
+    버리고 pop_failed()로 알립니다.
+    """
+
+    def __init__(self, backend, flush_interval=1, retry_delay=1, max_retry_delay=60):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._on_saved = {}
+        self._failed = []
+        self._wakeup = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="status-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, customer_id, new_status, store_code=None, on_saved=None):
+        """상태 변경 등록 (바로 반환, on_saved는 저장이 확인된 뒤 작업 스레드에서 호출)"""
+        with self._lock:
+            self._pending[str(customer_id)] = (new_status, store_code)
+            if on_saved is not None:
+                self._on_saved.setdefault(str(customer_id), []).append(on_saved)
+        self._wakeup.set()
+
+    def pop_failed(self, store_code=None):
+        """고객을 찾지 못해 저장하지 못한 [(고객 ID, 상태)] (store_code 지정 시 해당 매장만, 가져간 항목은 지움)"""
+        with self._lock:
+            failed = [item for item in self._failed if store_code is None or item[2] == store_code]
+            self._failed = [item for item in self._failed if item not in failed]
+        return [(customer_id, new_status) for customer_id, new_status, _ in failed]
+
+    def overrides(self):
+        """아직 저장되지 않은 {고객 ID(정수): 상태}"""
+        with self._lock:
+            return {
+                int(customer_id): new_status for customer_id, (new_status, _) in self._pending.items()
+                if customer_id.isdigit()
+            }
+
+    def flush(self):
+        """모인 변경을 저장 (저장 후 그 사이 다시 바뀌지 않은 변경만 목록에서 뺌)"""
+        with self._lock:
+            batch = dict(self._pending)
+            callbacks = {customer_id: self._on_saved.pop(customer_id, []) for customer_id in batch}
+        if not batch:
+            return
+
+        try:
+            updated = self.backend.update_customer_statuses([
+                (customer_id, new_status, store_code) for customer_id, (new_status, store_code) in batch.items()
+            ])
+        except Exception:
+            # 재시도에서 저장되면 그때 실행되도록 되돌려 놓음
+            with self._lock:
+                for customer_id, functions in callbacks.items():
+                    if functions:
+                        self._on_saved[customer_id] = functions + self._on_saved.get(customer_id, [])
+            raise
+        not_found = set(batch) - updated
+        if not_found:
+            self.last_error = f"고객을 찾을 수 없어 상태를 저장하지 못했습니다: {', '.join(sorted(not_found))}"
+            with self._lock:
+                self._failed.extend(
+                    (customer_id, batch[customer_id][0], batch[customer_id][1]) for customer_id in sorted(not_found)
+                )
+
+        # 캐시를 먼저 비워야 저장된 상태가 조회 결과에서 잠시 되돌아가지 않음
+        get_backend_cache(self.backend, "customer").invalidate()
+        with self._lock:
+            for customer_id, change in batch.items():
+                if self._pending.get(customer_id) == change:
+                    del self._pending[customer_id]
+
+        # 저장이 확인된 변경만 기록과 집계에 반영
+        for customer_id in updated:
+            for on_saved in callbacks.get(customer_id, []):
+                try:
+                    on_saved()
+                except Exception:
+                    pass
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            delay = self.retry_delay
+            while True:
+                try:
+                    self.flush()
+                    break
+                except Exception as e:
+                    self.last_error = str(e)
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+
+def get_storage_config():
+    """저장소 설정 조회 (secrets의 [storage] 섹션 또는 환경변수)"""
+    config = {}
+    try:
+        if "storage" in st.secrets:
+            config = dict(st.secrets["storage"])
+    except Exception:
+        pass
+
+    config.setdefault("backend", os.getenv("STORAGE_BACKEND", "sheets"))
+    config.setdefault("sqlite_path", os.getenv("SQLITE_PATH", "siteusim.db"))
+    config.setdefault("mirror_to_sheets", os.getenv("MIRROR_TO_SHEETS", "").lower() in ("1", "true", "yes"))
+    config.setdefault("customer_cache_ttl", float(os.getenv("CUSTOMER_CACHE_TTL", "10")))
+    config.setdefault("store_cache_ttl", float(os.getenv("STORE_CACHE_TTL", "3600")))
+    config.setdefault("phone_index_cache_ttl", float(os.getenv("PHONE_INDEX_CACHE_TTL", "300")))
+    # 중복 전화번호 확인 범위: all(전체 이력) / active(대기·처리중) / today(오늘 등록)
+    config.setdefault("duplicate_scope", os.getenv("DUPLICATE_PHONE_SCOPE", "all"))
+    # 완료 고객 자동 보관: 최근 archive_keep_days일만 customers에 남김 (0이면 사용 안 함)
+    config.setdefault("archive_keep_days", int(os.getenv("ARCHIVE_KEEP_DAYS", "0")))
+    config.setdefault("archive_partition", os.getenv("ARCHIVE_PARTITION", "month"))
+    config.setdefault("archive_stale_waiting", os.getenv("ARCHIVE_STALE_WAITING", "true").lower() in ("1", "true", "yes"))
+    config.setdefault("archive_check_interval", float(os.getenv("ARCHIVE_CHECK_INTERVAL", "3600")))
+    config.setdefault("sync_mode", os.getenv("SHEETS_SYNC_MODE", "incremental"))
+    config.setdefault("full_sync_interval", float(os.getenv("SHEETS_FULL_SYNC_INTERVAL", "600")))
+    # 고객 시트 분할: single(customers 하나) / store(매장별) / team(팀별)
+    config.setdefault("customer_sheet_layout", os.getenv("CUSTOMER_SHEET_LAYOUT", "single"))
+    # 등록 시 번호를 바로 발급하고 시트 저장은 백그라운드에서 처리
+    config.setdefault("async_registration", os.getenv("ASYNC_REGISTRATION", "true").lower() in ("1", "true", "yes"))
+    # 이 시간(초) 동안 들어온 등록을 모아 한 번의 append_rows로 저장 (0이면 묶지 않음)
+    config.setdefault("registration_batch_window", float(os.getenv("REGISTRATION_BATCH_WINDOW", "0.3")))
+    # 상태 변경은 바로 화면에 반영하고 시트에는 status_flush_interval초마다 모아서 저장
+    config.setdefault("status_write_behind", os.getenv("STATUS_WRITE_BEHIND", "true").lower() in ("1", "true", "yes"))
+    config.setdefault("status_flush_interval", float(os.getenv("STATUS_FLUSH_INTERVAL", "1")))
+    # 발급/완료 집계를 ticket_stats에 저장하는 주기 (초)
+    config.setdefault("ticket_stats_flush_interval", float(os.getenv("TICKET_STATS_FLUSH_INTERVAL", "30")))
+    # 상태 변경 기록(처리 시작/완료 시각)을 status_events에 저장하는 주기 (초)
+    config.setdefault("status_event_flush_interval", float(os.getenv("STATUS_EVENT_FLUSH_INTERVAL", "30")))
+    # 상태 변경 기록 자동 보관: 최근 status_event_keep_days일만 status_events에 남김 (0이면 사용 안 함)
+    config.setdefault("status_event_keep_days", int(os.getenv("STATUS_EVENT_KEEP_DAYS", "90")))
+    # 실행별 SheetsManager 호출 추적 (디버그 패널과 로그, 기본 꺼짐)
+    config.setdefault("trace_calls", os.getenv("TRACE_CALLS", "false").lower() in ("1", "true", "yes"))
+    # Prometheus 수집용 /metrics HTTP 포트 (0이면 사용 안 함, ?metrics 페이지는 항상 사용 가능)
+    config.setdefault("metrics_port", int(os.getenv("METRICS_PORT", "0")))
+    return config
+
+@st.cache_resource
+def init_storage_backend():
+    """설정에 따른 저장소 백엔드 초기화"""
+    config = get_storage_config()
+
+    if config["backend"] == "sqlite":
+        mirror = None
+        if config["mirror_to_sheets"]:
+            workbook, client = init_google_sheets()
+            if workbook is not None:
+                mirror = GoogleSheetsBackend(workbook, incremental_sync=False)
+        try:
+            backend = SQLiteBackend(config["sqlite_path"], mirror=mirror)
+        except Exception as e:
+            st.error(f"❌ SQLite 저장소 초기화 오류: {str(e)}")
+            return None
+        if not backend.has_stores():
+            # 미러가 없으면 매장/설정을 채울 곳이 없어 로그인할 수 없으므로 시작하지 않음
+            st.error(
+                "❌ SQLite 저장소에 매장이 없습니다. "
+                "`python Home.py import-sqlite stores.csv [settings.csv]`로 가져오거나 mirror_to_sheets를 켜세요."
+            )
+            return None
+    else:
+        workbook, client = init_google_sheets()
+        if workbook is None:
+            return None
+        backend = GoogleSheetsBackend(
+            workbook,
+            incremental_sync=config["sync_mode"] == "incremental",
+            full_sync_interval=config["full_sync_interval"],
+            layout=config["customer_sheet_layout"]
+        )
+
+    if backend.supports_deferred_add and (config["async_registration"] or config["registration_batch_window"] > 0):
+        # 비동기 등록이 꺼져 있으면 묶음 저장이 끝날 때까지 등록 요청이 기다림
+        backend.registration_pipeline = RegistrationPipeline(
+            backend,
+            batch_window=config["registration_batch_window"],
+            blocking=not config["async_registration"]
+        )
+
+    if config["status_write_behind"] and isinstance(backend, GoogleSheetsBackend):
+        backend.status_writer = StatusWriteQueue(backend, flush_interval=config["status_flush_interval"])
+
+    start_archive_worker(backend, config)
+    return backend
+
+def start_archive_worker(backend, config):
+    """완료 고객(과 오래된 상태 변경 기록) 보관 작업을 하루 한 번 실행하는 백그라운드 스레드 시작"""
+    if config["archive_keep_days"] <= 0 and config["status_event_keep_days"] <= 0:
+        return None
+
+    def run():
+        last_run_date = None
+        while True:
+            today = korea_today()
+            if today != last_run_date:
+                try:
+                    sheets_manager = SheetsManager(backend)
+                    if config["archive_keep_days"] > 0:
+                        sheets_manager.archive_customers()
+                    if config["status_event_keep_days"] > 0:
+                        sheets_manager.archive_status_events()
+                    last_run_date = today
+                except Exception:
+                    pass
+            time.sleep(config["archive_check_interval"])
+
+    worker = threading.Thread(target=run, name="customer-archiver", daemon=True)
+    worker.start()
+    return worker
+
+# 프로세스 전역 캐시
+class SnapshotCache:
+    """프로세스 전역 스냅샷 캐시
+
+    모든 세션(스레드)이 같은 스냅샷을 공유하고, TTL이 지나거나 invalidate() 되면 다시 로드합니다.
+    동시에 만료된 경우에도 로드는 한 번만 실행됩니다.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+        # 운영 지표용 (캐시 적중, 다시 로드, 변경 토큰 확인으로 유지)
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry
+        return None
+
+    def get(self, key, loader, revalidate=None):
+        """캐시된 값 반환, 없거나 만료되었으면 loader()로 로드
+
+        revalidate(이전 값)가 True를 반환하면 다시 로드하지 않고 이전 값의 유효 시간만 연장합니다.
+        """
+        with self._lock:
+            entry = self._fresh(key)
+            if entry:
+                self.hits += 1
+                return entry[0]
+
+        with self._load_lock:
+            with self._lock:
+                # 기다리는 동안 다른 세션이 이미 로드했을 수 있음
+                entry = self._fresh(key)
+                if entry:
+                    self.hits += 1
+                    return entry[0]
+                generation = self._generation
+                stale = self._entries.get(key)
+
+            if stale and revalidate is not None and revalidate(stale[0]):
+                value = stale[0]
+                self.revalidated += 1
+            else:
+                value = loader()
+                self.misses += 1
+
+            with self._lock:
+                # 로드 중에 무효화되었으면 오래된 값일 수 있으므로 저장하지 않음
+                if generation == self._generation:
+                    self._entries[key] = (value, time.monotonic())
+            return value
+
+    def loaded_at(self, key):
+        """현재 스냅샷을 로드한 시각 (없거나 만료되었으면 None)"""
+        with self._lock:
+            entry = self._fresh(key)
+            return entry[1] if entry else None
+
+    def invalidate(self):
+        """모든 캐시 항목 무효화"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+_backend_caches = weakref.WeakKeyDictionary()
+_backend_caches_lock = threading.Lock()
+
+def get_backend_cache(backend, name):
+    """백엔드별 스냅샷 캐시 (프로세스 전역, TTL은 설정의 '<name>_cache_ttl')"""
+    with _backend_caches_lock:
+        caches = _backend_caches.setdefault(backend, {})
+        if name not in caches:
+            caches[name] = SnapshotCache(get_storage_config()[f"{name}_cache_ttl"])
+        return caches[name]
+
+class StoreDirectory:
+    """매장 목록 색인 (매장 코드/매장명/팀 → 매장)"""
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.by_code = {}
+        self.by_name = {}
+        self.by_team = {}
+        for store in stores:
+            # 같은 값이 여러 번 나오면 기존처럼 첫 번째 매장을 사용
+            self.by_code.setdefault(store.get('store_code'), store)
+            self.by_name.setdefault(store.get('store_name'), store)
+            if store.get('team'):
+                self.by_team.setdefault(store['team'], []).append(store)
+        self.teams = sorted(self.by_team)
+
+# 스크립트 실행(rerun) 단위 조회 공유
+_request_memo = contextvars.ContextVar("request_memo", default=None)
+
+@contextmanager
+def request_scope():
+    """한 번의 스크립트 실행 동안 같은 시트 조회 결과를 공유하는 범위
+
+    범위 안에서는 각 워크시트를 최대 한 번만 읽고, 모든 헬퍼 함수가 그 결과를 함께 사용합니다.
+    이미 범위 안이면 바깥 범위를 그대로 사용합니다.
+    """
+    if _request_memo.get() is not None:
+        yield
+        return
+
+    token = _request_memo.set({})
+    try:
+        yield
+    finally:
+        _request_memo.reset(token)
+
+# 실행(rerun) 단위 호출 추적
+_run_trace = contextvars.ContextVar("run_trace", default=None)
+trace_logger = logging.getLogger("siteusim.trace")
+
+class RunTrace:
+    """한 번의 스크립트 실행 동안 SheetsManager 메서드별 호출 수, API 호출 수, 행/바이트 수, 시간
+
+    시간은 메서드 자체 시간(안에서 부른 추적 대상 메서드 제외)이고, 그중 API 응답을 기다린 시간이 network,
+    나머지가 parse(변환·집계)입니다. 실행 전체에서 메서드 밖의 시간은 render로 셉니다.
+    """
+
+    OTHER = "(기타)"
+
+    def __init__(self, page=None):
+        self.page = page
+        self.started = time.perf_counter()
+        self.methods = {}
+        self._stack = []
+
+    def _entry(self, name):
+        if name not in self.methods:
+            self.methods[name] = {"calls": 0, "api_calls": 0, "rows": 0, "bytes": 0, "network": 0.0, "time": 0.0}
+        return self.methods[name]
+
+    def _current(self):
+        return self._entry(self._stack[-1][0] if self._stack else self.OTHER)
+
+    @contextmanager
+    def method(self, name):
+        """name 메서드 한 번의 호출 기록"""
+        self._entry(name)["calls"] += 1
+        frame = [name, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            self.methods[name]["time"] += elapsed - frame[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def add_api_call(self, seconds, size):
+        entry = self._current()
+        entry["api_calls"] += 1
+        entry["bytes"] += size
+        entry["network"] += seconds
+        if not self._stack:
+            entry["time"] += seconds
+
+    def add_rows(self, count):
+        self._current()["rows"] += count
+
+    def summary(self):
+        """지금까지의 기록 (시간은 ms)"""
+        total = time.perf_counter() - self.started
+        methods = {
+            name: {
+                "calls": entry["calls"],
+                "api_calls": entry["api_calls"],
+                "rows": entry["rows"],
+                "bytes": entry["bytes"],
+                "network_ms": round(entry["network"] * 1000, 1),
+                "parse_ms": round(max(entry["time"] - entry["network"], 0) * 1000, 1),
+            }
+            for name, entry in self.methods.items()
+        }
+        traced = sum(entry["time"] for entry in self.methods.values())
+        return {
+            "page": self.page,
+            "total_ms": round(total * 1000, 1),
+            "api_calls": sum(entry["api_calls"] for entry in self.methods.values()),
+            "network_ms": round(sum(entry["network"] for entry in self.methods.values()) * 1000, 1),
+            "parse_ms": round(sum(method["parse_ms"] for method in methods.values()), 1),
+            "render_ms": round(max(total - traced, 0) * 1000, 1),
+            "methods": methods,
+        }
+
+@contextmanager
+def trace_scope(page=None):
+    """trace_calls가 켜져 있으면 이번 실행의 RunTrace를 만들고 끝날 때 로그 한 줄(JSON)로 남김 (꺼져 있으면 None)"""
+    if not get_storage_config()["trace_calls"] or _run_trace.get() is not None:
+        yield _run_trace.get()
+        return
+
+    if not trace_logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        trace_logger.addHandler(handler)
+        trace_logger.setLevel(logging.INFO)
+
+    trace = RunTrace(page)
+    token = _run_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _run_trace.reset(token)
+        trace_logger.info(json.dumps({"event": "run_trace", **trace.summary()}, ensure_ascii=False))
+
+def traced(method):
+    """SheetsManager 메서드 호출을 현재 실행의 RunTrace에 기록"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        trace = _run_trace.get()
+        if trace is None:
+            return method(*args, **kwargs)
+        with trace.method(method.__name__):
+            return method(*args, **kwargs)
+    return wrapper
+
+def trace_rows(values):
+    """저장소에서 읽은 행 수 기록 (values를 그대로 반환)"""
+    trace = _run_trace.get()
+    if trace is not None and values:
+        trace.add_rows(max(len(values) - 1, 0))
+    return values
+
+def instrument_http_client(client):
+    """gspread 요청마다 운영 지표(요청 수, 응답 시간, 429 제한)와 현재 실행의 RunTrace 기록"""
+    http_client = getattr(client, "http_client", client)
+    request = http_client.request
+
+    def traced_request(*args, **kwargs):
+        method = kwargs.get("method", args[0] if args else "")
+        started = time.perf_counter()
+        size = 0
+        status = "error"
+        try:
+            response = request(*args, **kwargs)
+            size = len(response.content or b"")
+            status = response.status_code
+            return response
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", "error")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            operational_metrics.record_api_call(method, status, elapsed)
+            trace = _run_trace.get()
+            if trace is not None:
+                trace.add_api_call(elapsed, size)
+
+    http_client.request = traced_request
+    return client
+
+# 운영 지표 (메모리에 있는 값만 사용)
+class OperationalMetrics:
+    """프로세스 전역 운영 지표 (등록 수, Google API 요청 수와 응답 시간, 429 제한 횟수)"""
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.registrations = {}
+        self._recent_registrations = collections.deque()
+        self.api_requests = {}
+        self.api_latency_buckets = [0] * len(self.LATENCY_BUCKETS)
+        self.api_latency_sum = 0.0
+        self.api_latency_count = 0
+        self.throttled = 0
+
+    def record_registration(self, store_code):
+        now = time.monotonic()
+        with self._lock:
+            self.registrations[str(store_code)] = self.registrations.get(str(store_code), 0) + 1
+            self._recent_registrations.append(now)
+            self._prune(now)
+
+    def _prune(self, now):
+        while self._recent_registrations and now - self._recent_registrations[0] > 60:
+            self._recent_registrations.popleft()
+
+    def registrations_last_minute(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return len(self._recent_registrations)
+
+    def record_api_call(self, method, status, seconds):
+        with self._lock:
+            key = (str(method).upper(), str(status))
+            self.api_requests[key] = self.api_requests.get(key, 0) + 1
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.api_latency_buckets[i] += 1
+            self.api_latency_sum += seconds
+            self.api_latency_count += 1
+            if str(status) == "429":
+                self.throttled += 1
+
+    def snapshot(self):
+        """현재 값 복사본"""
+        with self._lock:
+            return {
+                "registrations": dict(self.registrations),
+                "api_requests": dict(self.api_requests),
+                "api_latency_buckets": list(self.api_latency_buckets),
+                "api_latency_sum": self.api_latency_sum,
+                "api_latency_count": self.api_latency_count,
+                "throttled": self.throttled,
+            }
+
+operational_metrics = OperationalMetrics()
+
+def phone_key(phone):
+    """전화번호 비교용 키 (숫자만 남김)"""
+    return ''.join(filter(str.isdigit, str(phone)))
+
+def korea_today():
+    """한국 시간 기준 오늘 날짜"""
+    return datetime.now(pytz.timezone('Asia/Seoul')).date()
+
+class PhoneIndex:
+    """매장별 전화번호 색인
+
+    {매장 코드: {번호 키: {고객 ID: (상태, 등록일)}}} 형태로 보관해
+    매장 이력이 늘어나도 중복 확인이 상수 시간에 끝납니다.
+    """
+
+    ACTIVE_STATUSES = ('대기', '처리중')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_store = {}
+        self._locations = {}
+
+    @classmethod
+    def from_table(cls, table):
+        """고객 테이블로 색인 생성"""
+        index = cls()
+        registered_dates = table['registered_time'].dt.date
+        for store_code, phone, customer_id, status, registered_date in zip(
+                table['store_code'], table['phone'], table['id'], table['status'], registered_dates):
+            index._add(store_code, phone, customer_id, status, None if pd.isna(registered_date) else registered_date)
+        return index
+
+    def _add(self, store_code, phone, customer_id, status, registered_date):
+        key = phone_key(phone)
+        if not key:
+            return
+        self._by_store.setdefault(store_code, {}).setdefault(key, {})[customer_id] = (status, registered_date)
+        self._locations[str(customer_id)] = (store_code, key, customer_id)
+
+    def add(self, store_code, phone, customer_id, status, registered_date):
+        """등록된 고객 추가"""
+        with self._lock:
+            self._add(store_code, phone, customer_id, status, registered_date)
+
+    def set_status(self, customer_id, status):
+        """고객 상태 변경 반영"""
+        with self._lock:
+            location = self._locations.get(str(customer_id))
+            if location is None:
+                return
+            store_code, key, entry_id = location
+            entries = self._by_store[store_code][key]
+            entries[entry_id] = (status, entries[entry_id][1])
+
+    def contains(self, store_code, phone, scope="all"):
+        """해당 매장에 같은 번호가 있는지 확인 (scope: all / active / today)"""
+        with self._lock:
+            entries = self._by_store.get(store_code, {}).get(phone_key(phone))
+            if not entries:
+                return False
+            if scope == "active":
+                return any(status in self.ACTIVE_STATUSES for status, _ in entries.values())
+            if scope == "today":
+                today = korea_today()
+                return any(registered_date == today for _, registered_date in entries.values())
+            return True
+
+# 발급/완료 집계
+class TicketStats:
+    """매장·날짜·시간대·서비스 유형별 발급/완료 건수
+
+    등록과 상태 변경 때마다 해당 칸만 더하고, 바뀐 칸은 flush_interval초마다 백엔드의
+    ticket_stats 테이블(시트)에 저장합니다. 저장된 집계가 없으면 처음 사용할 때 고객 데이터로 채웁니다.
+    완료 건수는 완료한 시각이 아니라 발급(등록) 시각의 칸에 더하므로 고객 데이터로 다시 만들 수 있습니다.
+    """
+
+    def __init__(self, backend, flush_interval=30):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.last_error = None
+        self._lock = threading.RLock()
+        self._counts = {}
+        self._dirty = set()
+        self._loaded = False
+        self._frame = None
+        self._wakeup = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="ticket-stats-writer", daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def _key(store_code, registered_time, service_type):
+        return (registered_time.strftime('%Y-%m-%d'), str(store_code), registered_time.hour, str(service_type))
+
+    def ensure_loaded(self, load_customer_table):
+        """저장된 집계를 읽음 (없으면 load_customer_table()의 고객으로 채워 저장 예약)"""
+        with self._lock:
+            if self._loaded:
+                return
+
+            values = self.backend.get_ticket_stats_values()
+            if values and len(values) > 1:
+                for row in values[1:]:
+                    row = row + [''] * (len(TICKET_STATS_HEADERS) - len(row))
+                    if not row[0] or not row[2].isdigit():
+                        continue
+                    self._counts[(row[0], row[1], int(row[2]), row[3])] = [
+                        int(row[4]) if row[4].lstrip('-').isdigit() else 0,
+                        int(row[5]) if row[5].lstrip('-').isdigit() else 0,
+                    ]
+            else:
+                table = load_customer_table()
+                table = table[table['registered_time'].notna()]
+                grouped = pd.DataFrame({
+                    'date': table['registered_time'].dt.strftime('%Y-%m-%d'),
+                    'store_code': table['store_code'].astype(str),
+                    'hour': table['registered_time'].dt.hour,
+                    'service_type': table['service_type'].astype(str),
+                    'completed': table['status'] == '완료',
+                }).groupby(['date', 'store_code', 'hour', 'service_type'])['completed'].agg(['size', 'sum'])
+                for key, (issued, completed) in grouped.iterrows():
+                    self._counts[(key[0], key[1], int(key[2]), key[3])] = [int(issued), int(completed)]
+                self._dirty.update(self._counts)
+                self._wakeup.set()
+
+            self._loaded = True
+            self._frame = None
+
+    def record(self, store_code, registered_time, service_type, issued=0, completed=0):
+        """발급(issued)/완료(completed) 건수 반영 (집계를 읽기 전이면 무시, 나중에 고객 데이터로 채워짐)"""
+        with self._lock:
+            if not self._loaded:
+                return
+            key = self._key(store_code, registered_time, service_type)
+            counts = self._counts.setdefault(key, [0, 0])
+            counts[0] += issued
+            counts[1] += completed
+            self._dirty.add(key)
+            self._frame = None
+        self._wakeup.set()
+
+    def query(self, start_date=None, end_date=None, store_codes=None, by=("date",)):
+        """기간(start_date ~ end_date, 포함)의 발급/완료 건수를 by 열(date/store_code/hour/service_type)별로 합산"""
+        with self._lock:
+            if self._frame is None:
+                self._frame = pd.DataFrame(
+                    [key + tuple(counts) for key, counts in self._counts.items()],
+                    columns=TICKET_STATS_HEADERS
+                )
+            frame = self._frame
+
+        selected = pd.Series(True, index=frame.index)
+        if start_date is not None:
+            selected &= frame['date'] >= start_date.strftime('%Y-%m-%d')
+        if end_date is not None:
+            selected &= frame['date'] <= end_date.strftime('%Y-%m-%d')
+        if store_codes is not None:
+            selected &= frame['store_code'].isin([str(code) for code in store_codes])
+
+        by = list(by)
+        if not by:
+            return frame.loc[selected, ['issued', 'completed']].sum()
+        return frame[selected].groupby(by)[['issued', 'completed']].sum().reset_index()
+
+    def flush(self):
+        """바뀐 칸 저장 (실패하면 다음 저장 때 다시 시도)"""
+        with self._lock:
+            keys = list(self._dirty)
+            rows = [
+                [key[0], key[1], str(key[2]), key[3], str(self._counts[key][0]), str(self._counts[key][1])]
+                for key in keys
+            ]
+            self._dirty.clear()
+        if not rows:
+            return
+        try:
+            self.backend.save_ticket_stats(rows)
+        except Exception:
+            with self._lock:
+                self._dirty.update(keys)
+            raise
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self._wakeup.set()
+
+_ticket_stats = weakref.WeakKeyDictionary()
+
+def get_ticket_stats(backend):
+    """백엔드별 발급/완료 집계 (프로세스 전역)"""
+    with _backend_caches_lock:
+        if backend not in _ticket_stats:
+            _ticket_stats[backend] = TicketStats(backend, get_storage_config()["ticket_stats_flush_interval"])
+        return _ticket_stats[backend]
+
+# 상태 변경 기록
+class StatusEventLog:
+    """고객 상태 변경 기록 (바뀐 상태, 시각, 처리한 관리자 ID와 창구)
+
+    처리중 기록은 호출(처리 시작) 시각, 완료 기록은 처리 완료 시각입니다.
+    기록은 메모리에 바로 더하고 flush_interval초마다 백엔드의 status_events에 한 번에 추가합니다.
+    """
+
+    def __init__(self, backend, flush_interval=30):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._events = []
+        self._unsaved = []
+        self._loaded = False
+        self._frame = None
+        self._wakeup = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="status-event-writer", daemon=True)
+        self._worker.start()
+
+    def ensure_loaded(self):
+        """저장된 기록 읽기 (처음 한 번)"""
+        with self._lock:
+            if self._loaded:
+                return
+            values = self.backend.get_status_event_values() or []
+            width = len(STATUS_EVENT_HEADERS)
+            stored = [tuple((row + [''] * width)[:width]) for row in values[1:]]
+            # 읽기 전에 기록했고 이미 저장된 행은 한 번만 남김
+            known = set(stored)
+            self._events = stored + [row for row in self._events if row not in known]
+            self._loaded = True
+            self._frame = None
+
+    def record(self, customer_id, store_code, service_type, registered_time, status,
+               admin_id=None, counter=None, event_time=None):
+        """상태 변경 기록 추가 (시간은 한국 시간 기준 naive datetime, 등록 시간을 모르면 None)"""
+        event_time = event_time or datetime.now(pytz.timezone('Asia/Seoul')).replace(tzinfo=None)
+        row = (
+            str(customer_id), str(store_code), str(service_type),
+            registered_time.strftime(STATUS_EVENT_TIME_FORMAT) if registered_time is not None else '', str(status),
+            event_time.strftime(STATUS_EVENT_TIME_FORMAT), admin_id or '', counter or ''
+        )
+        with self._lock:
+            self._events.append(row)
+            self._unsaved.append(row)
+            self._frame = None
+        self._wakeup.set()
+
+    def forget_before(self, cutoff):
+        """보관으로 옮긴 cutoff 이전 기록을 메모리에서도 제거 (저장 전 기록은 유지)"""
+        cutoff_text = cutoff.strftime(STATUS_EVENT_TIME_FORMAT)
+        with self._lock:
+            unsaved = set(self._unsaved)
+            self._events = [
+                row for row in self._events if not row[5] or row[5] >= cutoff_text or row in unsaved
+            ]
+            self._frame = None
+
+    def frame(self):
+        """기록 전체 DataFrame (시각 열은 datetime, 공유되므로 변경하지 말 것)"""
+        with self._lock:
+            if self._frame is None:
+                frame = pd.DataFrame(self._events, columns=STATUS_EVENT_HEADERS)
+                for column in ('registered_time', 'event_time'):
+                    frame[column] = pd.to_datetime(frame[column], format=STATUS_EVENT_TIME_FORMAT, errors='coerce')
+                self._frame = frame
+            return self._frame
+
+    def flush(self):
+        """저장하지 않은 기록 추가 (실패하면 다음 저장 때 다시 시도)"""
+        with self._lock:
+            rows = self._unsaved
+            self._unsaved = []
+        if not rows:
+            return
+        try:
+            self.backend.append_status_events([list(row) for row in rows])
+        except Exception:
+            with self._lock:
+                self._unsaved = rows + self._unsaved
+            raise
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self._wakeup.set()
+
+_status_event_logs = weakref.WeakKeyDictionary()
+
+def get_status_event_log(backend):
+    """백엔드별 상태 변경 기록 (프로세스 전역)"""
+    with _backend_caches_lock:
+        if backend not in _status_event_logs:
+            _status_event_logs[backend] = StatusEventLog(backend, get_storage_config()["status_event_flush_interval"])
+        return _status_event_logs[backend]
+
+def summarize_service_times(events, store_code, start_date=None, end_date=None):
+    """상태 변경 기록으로 매장 처리 시간 지표 계산
+
+    대기 시간은 등록부터 처음 처리중이 된 시각까지, 처리 시간은 마지막 처리중부터 완료까지입니다.
+    시간당 처리 인원은 완료 기록을 시간대별로 세어 완료가 있었던 날 수로 나눈 값입니다.
+    """
+    events = events[events['store_code'] == str(store_code)]
+    event_dates = events['event_time'].dt.date
+    if start_date is not None:
+        events = events[event_dates >= start_date]
+        event_dates = event_dates[events.index]
+    if end_date is not None:
+        events = events[event_dates <= end_date]
+    events = events.sort_values('event_time', kind='stable')
+
+    started = events[events['status'] == '처리중']
+    first_started = started.drop_duplicates('customer_id', keep='first')
+    waits = (first_started['event_time'] - first_started['registered_time']).dt.total_seconds() / 60
+
+    served = events[events['status'] == '완료'].drop_duplicates('customer_id', keep='last').copy()
+    last_started = started.drop_duplicates('customer_id', keep='last').set_index('customer_id')
+    started_at = last_started['event_time'].reindex(served['customer_id']).to_numpy()
+    durations = (served['event_time'] - started_at).dt.total_seconds() / 60
+    served['service_minutes'] = durations.where(durations >= 0)
+    # 창구는 호출한 창구 기준, 없으면 완료한 창구
+    started_counter = last_started['counter'].reindex(served['customer_id']).fillna('').to_numpy()
+    served['counter'] = served['counter'].where(started_counter == '', started_counter)
+    served['counter'] = served['counter'].replace('', '미지정')
+
+    def by(column):
+        return served.groupby(column).agg(
+            served=('customer_id', 'size'),
+            median_service=('service_minutes', 'median'),
+        ).reset_index()
+
+    hours = served['event_time'].dt.hour
+    days = max(served['event_time'].dt.date.nunique(), 1)
+    per_hour = (hours.value_counts().sort_index() / days).rename_axis('hour').reset_index(name='customers_per_hour')
+
+    return {
+        'served': len(served),
+        'median_wait': None if waits.dropna().empty else float(waits.median()),
+        'median_service': None if served['service_minutes'].dropna().empty else float(served['service_minutes'].median()),
+        'by_service_type': by('service_type'),
+        'by_counter': by('counter'),
+        'per_hour': per_hour,
+    }
+
+def estimated_service_minutes(service_type):
+    """등록 시 저장하는 서비스 유형별 예상 시간 (분)"""
+    return 3 if service_type in ["유심교체", "유심재설정"] else 10
+
+# 예상 대기 시간
+class WaitEstimator:
+    """매장별 예상 대기 시간
+
+    매장·서비스 유형별 대기 인원, 처리중 인원, 최근 활동한 창구는 등록과 상태 변경 때 더하고 빼서 유지하고,
+    유형별 처리 시간은 완료될 때마다 지수 이동 평균으로 갱신합니다 (완료 기록이 없으면 estimated_service_minutes).
+    예상 시간 = Σ(유형별 대기 인원 × 평균 처리 시간) ÷ 일하는 창구 수 이므로 고객 데이터를 다시 훑지 않습니다.
+    보관·다른 프로세스의 변경으로 어긋나지 않도록 고객 스냅샷이 새로 로드될 때마다 인원만 다시 맞춥니다(reconcile).
+    """
+
+    SMOOTHING = 0.2
+    MAX_SAMPLE_MINUTES = 60
+    ACTIVE_COUNTER_MINUTES = 30
+
+    def __init__(self):
+        # 초기값을 읽는 동안 스냅샷 로드가 reconcile을 다시 부르므로 재진입 가능한 잠금 사용
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._waiting = {}
+        self._processing = {}
+        self._service_minutes = {}
+        self._started = {}
+        self._counters = {}
+        self._reconciled = {}
+
+    @staticmethod
+    def _now():
+        return datetime.now(pytz.timezone('Asia/Seoul')).replace(tzinfo=None)
+
+    def ensure_loaded(self, load_customer_table, load_status_events):
+        """현재 대기열과 상태 변경 기록으로 초기값 계산 (처음 한 번)"""
+        with self._lock:
+            if self._loaded:
+                return
+
+            table = load_customer_table()
+            events = load_status_events().sort_values('event_time', kind='stable')
+
+            self._waiting, self._processing = self._queue_counts(table)
+            self._reconciled[None] = table.attrs.get("loaded_at")
+            processing = table[table['status'] == '처리중']
+
+            # 완료 기록 순서대로 처리 시간 평균 재계산
+            started = {}
+            for customer_id, store_code, service_type, status, event_time in zip(
+                    events['customer_id'], events['store_code'], events['service_type'],
+                    events['status'], events['event_time']):
+                if status == '처리중':
+                    started[customer_id] = event_time
+                elif status == '완료' and customer_id in started:
+                    self._add_sample(store_code, service_type, started.pop(customer_id), event_time)
+            processing_ids = set(processing['id'].astype(str))
+            self._started = {
+                customer_id: started_at for customer_id, started_at in started.items() if customer_id in processing_ids
+            }
+
+            recent = events[events['event_time'] >= self._now() - timedelta(minutes=self.ACTIVE_COUNTER_MINUTES)]
+            for store_code, counter, admin_id, event_time in zip(
+                    recent['store_code'], recent['counter'], recent['admin_id'], recent['event_time']):
+                if counter or admin_id:
+                    self._counters.setdefault(store_code, {})[counter or admin_id] = event_time
+
+            self._loaded = True
+
+    @staticmethod
+    def _queue_counts(table):
+        """고객 테이블의 ({매장: {서비스 유형: 대기 인원}}, {매장: 처리중 인원})"""
+        waiting = {}
+        for (store_code, service_type), count in table[table['status'] == '대기'].groupby(
+                ['store_code', 'service_type'], observed=True).size().items():
+            waiting.setdefault(str(store_code), {})[str(service_type)] = int(count)
+        processing = {
+            str(store_code): int(count)
+            for store_code, count in table[table['status'] == '처리중'].groupby('store_code', observed=True).size().items()
+        }
+        return waiting, processing
+
+    def reconcile(self, table, store_code=None):
+        """새로 로드된 고객 스냅샷으로 대기/처리중 인원 다시 계산 (store_code가 없으면 전체 매장)
+
+        같은 스냅샷이나 이미 반영한 것보다 오래된 스냅샷이면 건너뜁니다 (attrs의 loaded_at으로 비교).
+        """
+        loaded_at = table.attrs.get("loaded_at")
+        with self._lock:
+            if not self._loaded or loaded_at is None:
+                return
+            latest = max(self._reconciled.get(store_code) or 0, self._reconciled.get(None) or 0)
+            if loaded_at <= latest:
+                return
+
+            waiting, processing = self._queue_counts(table)
+            if store_code is None:
+                self._waiting, self._processing = waiting, processing
+            else:
+                store_code = str(store_code)
+                self._waiting[store_code] = waiting.get(store_code, {})
+                self._processing[store_code] = processing.get(store_code, 0)
+            self._reconciled[store_code] = loaded_at
+
+    def _add_sample(self, store_code, service_type, started_at, completed_at):
+        minutes = (completed_at - started_at).total_seconds() / 60
+        if pd.isna(minutes) or minutes < 0:
+            return
+        minutes = min(minutes, self.MAX_SAMPLE_MINUTES)
+        key = (store_code, service_type)
+        average = self._service_minutes.get(key, estimated_service_minutes(service_type))
+        self._service_minutes[key] = average + self.SMOOTHING * (minutes - average)
+
+    def record_issue(self, store_code, service_type):
+        """새 대기 고객 반영"""
+        with self._lock:
+            if not self._loaded:
+                return
+            counts = self._waiting.setdefault(str(store_code), {})
+            counts[str(service_type)] = counts.get(str(service_type), 0) + 1
+
+    def record_status(self, customer_id, store_code, service_type, old_status, new_status, counter=None,
+                      event_time=None):
+        """상태 변경 반영 (counter: 처리한 창구 또는 관리자, event_time: 변경 시각, 없으면 현재)"""
+        store_code, service_type, customer_id = str(store_code), str(service_type), str(customer_id)
+        now = event_time or self._now()
+        with self._lock:
+            if not self._loaded:
+                return
+            counts = self._waiting.setdefault(store_code, {})
+            if old_status == '대기':
+                counts[service_type] = max(counts.get(service_type, 0) - 1, 0)
+            elif old_status == '처리중':
+                self._processing[store_code] = max(self._processing.get(store_code, 0) - 1, 0)
+
+            if new_status == '대기':
+                counts[service_type] = counts.get(service_type, 0) + 1
+            elif new_status == '처리중':
+                self._processing[store_code] = self._processing.get(store_code, 0) + 1
+                self._started[customer_id] = now
+            elif new_status == '완료' and customer_id in self._started:
+                self._add_sample(store_code, service_type, self._started.pop(customer_id), now)
+
+            if counter:
+                self._counters.setdefault(store_code, {})[counter] = now
+
+    def queue_counts(self):
+        """{매장 코드: (대기 인원, 처리중 인원)} (초기값을 읽기 전이면 None)"""
+        with self._lock:
+            if not self._loaded:
+                return None
+            store_codes = set(self._waiting) | set(self._processing)
+            return {
+                store_code: (sum(self._waiting.get(store_code, {}).values()), self._processing.get(store_code, 0))
+                for store_code in store_codes
+            }
+
+    def estimate(self, store_code):
+        """(대기 인원, 예상 대기 시간(분)) 반환, 초기값을 읽지 못했으면 (None, None)"""
+        store_code = str(store_code)
+        with self._lock:
+            if not self._loaded:
+                return None, None
+            counts = self._waiting.get(store_code, {})
+            waiting_count = sum(counts.values())
+            work = sum(
+                count * self._service_minutes.get((store_code, service_type), estimated_service_minutes(service_type))
+                for service_type, count in counts.items()
+            )
+            # 최근 활동한 창구 수, 동시에 처리중인 인원 중 큰 값을 일하는 창구 수로 봄
+            cutoff = self._now() - timedelta(minutes=self.ACTIVE_COUNTER_MINUTES)
+            counters = self._counters.get(store_code, {})
+            active_counters = sum(1 for last_seen in counters.values() if last_seen >= cutoff)
+            servers = max(1, active_counters, self._processing.get(store_code, 0))
+        return waiting_count, math.ceil(work / servers)
+
+_wait_estimators = weakref.WeakKeyDictionary()
+
+def get_wait_estimator(backend):
+    """백엔드별 예상 대기 시간 계산기 (프로세스 전역)"""
+    with _backend_caches_lock:
+        if backend not in _wait_estimators:
+            _wait_estimators[backend] = WaitEstimator()
+        return _wait_estimators[backend]
+
+def _metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_metrics():
+    """Prometheus 텍스트 형식 운영 지표 (메모리의 값만 사용하므로 시트를 읽지 않음)"""
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_metric_label(label)}"' for key, label in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    with _backend_caches_lock:
+        backends = list(_backend_caches.items())
+        estimators = list(_wait_estimators.values())
+
+    queue_counts = {}
+    for estimator in estimators:
+        queue_counts.update(estimator.queue_counts() or {})
+    metric("siteusim_waiting_customers", "gauge", "Customers waiting per store",
+           [((("store", code),), counts[0]) for code, counts in sorted(queue_counts.items())])
+    metric("siteusim_processing_customers", "gauge", "Customers being served per store",
+           [((("store", code),), counts[1]) for code, counts in sorted(queue_counts.items())])
+
+    snapshot = operational_metrics.snapshot()
+    metric("siteusim_registrations_total", "counter", "Tickets issued since process start",
+           [((("store", code),), count) for code, count in sorted(snapshot["registrations"].items())])
+    metric("siteusim_registrations_per_minute", "gauge", "Tickets issued in the last 60 seconds",
+           [((), operational_metrics.registrations_last_minute())])
+
+    metric("siteusim_google_api_requests_total", "counter", "Google Sheets API requests",
+           [((("method", method), ("code", code)), count)
+            for (method, code), count in sorted(snapshot["api_requests"].items())])
+    name = "siteusim_google_api_request_duration_seconds"
+    lines.append(f"# HELP {name} Google Sheets API request latency")
+    lines.append(f"# TYPE {name} histogram")
+    for bound, count in zip(OperationalMetrics.LATENCY_BUCKETS, snapshot["api_latency_buckets"]):
+        lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {snapshot["api_latency_count"]}')
+    lines.append(f"{name}_sum {snapshot['api_latency_sum']:.6f}")
+    lines.append(f"{name}_count {snapshot['api_latency_count']}")
+    metric("siteusim_google_api_throttled_total", "counter", "Google Sheets API requests rejected with 429",
+           [((), snapshot["throttled"])])
+
+    cache_samples = []
+    ratio_samples = []
+    pending_registrations = 0
+    pending_status_writes = 0
+    for backend, caches in backends:
+        for name, cache in sorted(caches.items()):
+            cache_samples += [
+                ((("cache", name), ("result", "hit")), cache.hits),
+                ((("cache", name), ("result", "revalidated")), cache.revalidated),
+                ((("cache", name), ("result", "miss")), cache.misses),
+            ]
+            lookups = cache.hits + cache.revalidated + cache.misses
+            # 변경 토큰 확인으로 유지한 경우도 전체 조회를 피했으므로 적중으로 봄
+            ratio_samples.append(((("cache", name),), f"{(cache.hits + cache.revalidated) / lookups:.4f}" if lookups else 0))
+        if backend.registration_pipeline is not None:
+            pending_registrations += len(backend.registration_pipeline.pending_rows())
+        if backend.status_writer is not None:
+            pending_status_writes += len(backend.status_writer.overrides())
+    metric("siteusim_cache_requests_total", "counter", "Snapshot cache lookups by result", cache_samples)
+    metric("siteusim_cache_hit_ratio", "gauge", "Share of snapshot cache lookups served without a full read",
+           ratio_samples)
+    metric("siteusim_pending_registrations", "gauge", "Registrations not yet written to storage",
+           [((), pending_registrations)])
+    metric("siteusim_pending_status_writes", "gauge", "Status changes not yet written to storage",
+           [((), pending_status_writes)])
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(config):
+    """metrics_port가 설정되어 있으면 /metrics를 제공하는 HTTP 서버 스레드 시작"""
+    if config["metrics_port"] <= 0:
+        return None
+    try:
+        server = http.server.ThreadingHTTPServer(("", config["metrics_port"]), _MetricsHandler)
+    except OSError:
+        # 이미 다른 프로세스가 사용 중이면 ?metrics 페이지만 사용
+        return None
+    worker = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    worker.start()
+    return server
+
+@st.cache_resource
+def init_metrics_server():
+    """/metrics HTTP 서버를 프로세스당 한 번 시작 (앱 시작 시 호출, 저장소 초기화와 무관)"""
+    return start_metrics_server(get_storage_config())
+
+# 고객 테이블 (컬럼형)
+CUSTOMER_CATEGORY_COLUMNS = ["status", "store_code", "service_type"]
+CUSTOMER_DEFAULTS = {"status": "대기", "store_code": "UNKNOWN", "service_type": "기타"}
+
+# format_korean_datetime() 형식이 기본이며, 예전 데이터의 형식도 함께 지원
+REGISTERED_TIME_FORMATS = ["%y-%m-%d, %I:%M %p", "%Y-%m-%d %H:%M:%S"]
+
+def _parse_iso_time(time_str):
+    """ISO 8601 문자열 변환 (타임존이 있으면 한국 시간으로 바꾼 뒤 제거, 실패 시 None)"""
+    try:
+        parsed = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.timezone('Asia/Seoul')).replace(tzinfo=None)
+    return parsed
+
+def parse_registered_times(values):
+    """registered_time 열 일괄 변환
+
+    같은 값은 한 번만 파싱하고, 형식별로 남은 값 전체를 한 번에 변환합니다.
+    어떤 형식에도 맞지 않는 값은 현재 시각으로 대체하지 않고 NaT로 남깁니다.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna('').astype(str))
+    uniques = pd.Series(uniques, dtype=object)
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+
+    remaining = uniques != ''
+    for time_format in REGISTERED_TIME_FORMATS:
+        if not remaining.any():
+            break
+        attempt = pd.to_datetime(uniques[remaining], format=time_format, errors='coerce')
+        parsed[remaining] = attempt
+        remaining &= parsed.isna()
+
+    # 드물게 섞인 ISO 형식만 개별 변환
+    iso_candidates = remaining & uniques.str.contains('T', regex=False)
+    if iso_candidates.any():
+        parsed[iso_candidates] = pd.to_datetime(uniques[iso_candidates].map(_parse_iso_time), errors='coerce')
+
+    if len(codes) == 0:
+        return pd.Series([], dtype='datetime64[ns]')
+    return pd.Series(parsed.to_numpy()[codes], dtype='datetime64[ns]')
+
+def empty_customer_table():
+    """빈 고객 테이블"""
+    table = pd.DataFrame({header: pd.Series(dtype=object) for header in CUSTOMER_HEADERS})
+    return _normalize_customer_table(table)
+
+def _normalize_customer_table(table):
+    """컬럼 타입 변환 및 기본값 채우기 (모두 벡터 연산)"""
+    ids = table['id'].astype(str)
+    table['id'] = ids.where(ids.str.isdigit(), '0').astype('int64')
+
+    tickets = pd.to_numeric(table['store_ticket_number'], errors='coerce')
+    table['store_ticket_number'] = tickets.where(tickets == tickets.round(), 0).fillna(0).astype('int64')
+
+    for column in CUSTOMER_CATEGORY_COLUMNS:
+        values = table[column].astype(str)
+        table[column] = values.where(values != '', CUSTOMER_DEFAULTS[column]).astype('category')
+
+    # 변환할 수 없는 등록 시간은 NaT로 두고 표시만 함
+    registered_times = parse_registered_times(table['registered_time'])
+    registered_times.index = table.index
+    table['registered_time'] = registered_times
+    table['registered_time_invalid'] = registered_times.isna()
+    table['pending_sync'] = False
+    return table
+
+def build_customer_table(all_values):
+    """시트 값(헤더 포함 2차원 리스트)을 고객 DataFrame으로 변환
+
+    status, store_code, service_type은 범주형으로 저장해 스냅샷 메모리를 줄이고,
+    매장/상태 필터와 집계를 벡터 연산으로 처리합니다.
+    """
+    if not all_values or len(all_values) < 2:
+        return empty_customer_table()
+
+    headers = all_values[0]
+    width = len(headers)
+    rows = [row if len(row) == width else (row + [''] * (width - len(row)))[:width] for row in all_values[1:]]
+    table = pd.DataFrame(rows, columns=headers, dtype=object)
+    table = table.loc[:, ~table.columns.duplicated()]
+
+    for header in CUSTOMER_HEADERS:
+        if header not in table.columns:
+            table[header] = ''
+
+    # id나 이름이 없는 행(빈 행 포함)은 제외
+    table = table[(table['id'] != '') & (table['name'] != '')].reset_index(drop=True)
+    return _normalize_customer_table(table)
+
+def add_pending_customers(table, pending_rows):
+    """아직 저장되지 않은 고객 행을 테이블 뒤에 추가 (pending_sync 열이 True)"""
+    pending = build_customer_table([list(CUSTOMER_HEADERS)] + pending_rows)
+    pending = pending[~pending['id'].isin(table['id'])]
+    if pending.empty:
+        return table
+
+    pending['pending_sync'] = True
+    combined = pd.concat([table, pending], ignore_index=True)
+    for column in CUSTOMER_CATEGORY_COLUMNS:
+        combined[column] = combined[column].astype(str).astype('category')
+    combined.attrs = dict(table.attrs)
+    return combined
+
+def apply_status_overrides(table, overrides):
+    """저장 전인 상태 변경({고객 ID: 상태})을 반영한 테이블 (원본 스냅샷은 바꾸지 않음)"""
+    changed = table['id'].isin(list(overrides))
+    if not changed.any():
+        return table
+
+    table = table.copy()
+    statuses = table['status'].astype(str)
+    statuses[changed] = table.loc[changed, 'id'].map(overrides)
+    table['status'] = statuses.astype('category')
+    return table
+
+def customer_records(table):
+    """고객 테이블을 기존 형식의 딕셔너리 목록으로 변환"""
+    if table.empty:
+        return []
+
+    records = table.astype({column: object for column in CUSTOMER_CATEGORY_COLUMNS}).to_dict('records')
+    for record in records:
+        registered_time = record['registered_time']
+        record['registered_time'] = None if pd.isna(registered_time) else registered_time.to_pydatetime()
+    return records
+
+# 고객 데이터 내보내기 형식: 형식 → (표시 이름, 확장자, MIME)
+EXPORT_FORMATS = {
+    "xlsx": ("엑셀 (.xlsx)", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV (.csv)", "csv", "text/csv"),
+    "parquet": ("Parquet (.parquet)", "parquet", "application/octet-stream"),
+}
+
+def available_export_formats():
+    """설치된 패키지로 만들 수 있는 내보내기 형식 (Parquet는 pyarrow 또는 fastparquet 필요)"""
+    formats = ["xlsx", "csv"]
+    if importlib.util.find_spec("pyarrow") or importlib.util.find_spec("fastparquet"):
+        formats.append("parquet")
+    return formats
+
+def filter_by_registered_date(table, start_date=None, end_date=None):
+    """등록일이 start_date ~ end_date(포함)인 고객만 남김 (등록 시간을 알 수 없는 행은 제외)"""
+    if start_date is None and end_date is None:
+        return table
+    registered_dates = table['registered_time'].dt.date
+    selected = table['registered_time'].notna()
+    if start_date is not None:
+        selected &= registered_dates >= start_date
+    if end_date is not None:
+        selected &= registered_dates <= end_date
+    return table[selected]
+
+def export_customer_table(table, file_format, sheet_name='전체 고객 목록'):
+    """고객 테이블을 내보내기 파일 바이트로 변환
+
+    xlsx는 xlsxwriter의 constant_memory 모드로 한 행씩 기록해 행 수가 많아도 메모리가 늘지 않습니다.
+    """
+    table = table[CUSTOMER_HEADERS].sort_values(by='registered_time', kind='stable')
+
+    if file_format == "csv":
+        # 엑셀에서 한글이 깨지지 않도록 BOM 포함
+        return table.to_csv(index=False).encode('utf-8-sig')
+
+    output = io.BytesIO()
+    if file_format == "parquet":
+        table.astype({column: str for column in CUSTOMER_CATEGORY_COLUMNS}).to_parquet(output, index=False)
+        return output.getbuffer().tobytes()
+
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(sheet_name)
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    time_column = CUSTOMER_HEADERS.index('registered_time')
+
+    # 열을 파이썬 값 목록으로 한 번에 바꾼 뒤 셀마다 형식에 맞는 write_*를 바로 호출
+    columns = [
+        [None if pd.isna(value) else value.to_pydatetime() for value in table[header]]
+        if header == 'registered_time' else table[header].astype(object).tolist()
+        for header in CUSTOMER_HEADERS
+    ]
+    worksheet.write_row(0, 0, CUSTOMER_HEADERS)
+    for row_number, row in enumerate(zip(*columns), start=1):
+        for column, value in enumerate(row):
+            if column == time_column:
+                if value is not None:
+                    worksheet.write_datetime(row_number, column, value, datetime_format)
+            elif isinstance(value, str):
+                worksheet.write_string(row_number, column, value)
+            else:
+                worksheet.write_number(row_number, column, value)
+    workbook.close()
+    return output.getbuffer().tobytes()
+
 # Google Sheets 데이터 관리 클래스
 class SheetsManager:
-    def __init__(self, workbook):
-        self.workbook = workbook
+    def __init__(self, backend):
+        # 번호 발급기와 캐시, 집계 스레드는 백엔드별로 공유되므로 호출마다 새 백엔드를 만들지 않도록
+        # init_storage_backend()가 돌려준 백엔드만 받음
+        if not isinstance(backend, StorageBackend):
+            raise TypeError("SheetsManager에는 워크북이 아닌 StorageBackend(init_storage_backend())를 넘기세요")
+        self.backend = backend
+        self.customer_cache = get_backend_cache(backend, "customer")
+        self.store_cache = get_backend_cache(backend, "store")
+        self.phone_index_cache = get_backend_cache(backend, "phone_index")
+        self.ticket_stats = get_ticket_stats(backend)
+        self.status_events = get_status_event_log(backend)
+        self.wait_estimator = get_wait_estimator(backend)
+
+    def _read_values(self, table, loader, key=None):
+        """request_scope 안에서는 같은 테이블을 한 번만 읽음"""
+        memo = _request_memo.get()
+        if memo is None:
+            return loader()
+
+        memo_key = (id(self.backend), table, key)
+        if memo_key not in memo:
+            memo[memo_key] = loader()
+        return memo[memo_key]
+
+    def _forget_values(self, table):
+        """쓰기 후 현재 실행에서 읽어 둔 테이블 값 제거"""
+        memo = _request_memo.get()
+        if memo is None:
+            return
+
+        for memo_key in [k for k in memo if k[0] == id(self.backend) and k[1] == table]:
+            del memo[memo_key]
         
-    def get_all_stores(self):
-        """모든 매장 정보 조회"""
-        try:
-            sheet = self.workbook.worksheet("stores")
-            all_values = sheet.get_all_values()
-            
-            if not all_values or len(all_values) < 2:
-                return []
-            
-            headers = all_values[0]
-            data = []
-            
-            for row in all_values[1:]:
-                if not any(cell.strip() for cell in row if cell):
-                    continue
-                
-                while len(row) < len(headers):
-                    row.append('')
-                
-                row_dict = {}
-                for i, header in enumerate(headers):
-                    if i < len(row):
-                        row_dict[header] = row[i]
-                    else:
-                        row_dict[header] = ''
-                
-                if row_dict.get('store_code') and row_dict.get('store_name'):
-                    data.append(row_dict)
+    def _load_stores(self):
+        """stores 시트를 읽어 매장 목록 생성"""
+        all_values = self._read_values("stores", lambda: trace_rows(self.backend.get_store_values()))
+        
+        if not all_values or len(all_values) < 2:
+            return []
+        
+        headers = all_values[0]
+        data = []
+        
+        for row in all_values[1:]:
+            if not any(cell.strip() for cell in row if cell):
+                continue
             
-            return data
+            row_dict = {}
+            for i, header in enumerate(headers):
+                if i < len(row):
+                    row_dict[header] = row[i]
+                else:
+                    row_dict[header] = ''
             
+            if row_dict.get('store_code') and row_dict.get('store_name'):
+                data.append(row_dict)
+        
+        return data
+
+    def get_store_directory(self):
+        """매장 색인 조회 (프로세스 전역 캐시, 관리자 등록 시 갱신)"""
+        try:
+            return self.store_cache.get(None, lambda: StoreDirectory(self._load_stores()))
         except gspread.exceptions.WorksheetNotFound:
-            return []
+            return StoreDirectory([])
         except Exception as e:
             st.error(f"매장 정보 조회 오류: {str(e)}")
-            return []
+            return StoreDirectory([])
+        
+    @traced
+    def get_all_stores(self):
+        """모든 매장 정보 조회"""
+        return list(self.get_store_directory().stores)
     
     def get_store_by_code(self, store_code):
         """특정 매장 정보 조회"""
-        stores = self.get_all_stores()
-        for store in stores:
-            if store.get('store_code') == store_code:
-                return store
-        return None
+        return self.get_store_directory().by_code.get(store_code)
     
+    @traced
+    def get_customer_table(self, store_code=None):
+        """고객 테이블 조회 (DataFrame, 스냅샷은 모든 세션이 공유하므로 변경하지 말 것)"""
+        try:
+            return self._read_customer_table(store_code)
+        except Exception as e:
+            return empty_customer_table()
+
+    def _read_customer_table(self, store_code=None):
+        """get_customer_table과 같지만 읽기 오류를 그대로 전달 (빈 테이블로 초기값을 만들면 안 되는 곳에서 사용)"""
+        # 시트 백엔드는 전체 스냅샷 하나를 모든 매장이 공유
+        cache_key = store_code if self.backend.supports_store_filter else None
+        # 저장 대기 행을 먼저 가져와야 그 사이 저장된 행이 양쪽 모두에서 빠지지 않음
+        pending_rows = self._pending_rows(store_code)
+        status_overrides = self._status_overrides()
+        table = self._read_values("customers", lambda: self._load_customer_table(cache_key), cache_key)
+        if pending_rows:
+            table = add_pending_customers(table, pending_rows)
+        if status_overrides:
+            table = apply_status_overrides(table, status_overrides)
+        # 스냅샷이 새로 로드되었으면 예상 대기 시간의 인원도 맞춤 (이미 읽은 테이블의 집계만)
+        self.wait_estimator.reconcile(table, cache_key)
+
+        if store_code:
+            table = table[table['store_code'] == store_code]
+        return table
+
+    def _pending_rows(self, store_code=None):
+        """비동기 등록 파이프라인에서 아직 저장되지 않은 고객 행"""
+        pipeline = self.backend.registration_pipeline
+        return pipeline.pending_rows(store_code) if pipeline is not None else []
+
+    def _status_overrides(self):
+        """쓰기 지연 큐에서 아직 저장되지 않은 상태 변경"""
+        status_writer = self.backend.status_writer
+        return status_writer.overrides() if status_writer is not None else {}
+
+    def _load_customer_table(self, cache_key):
+        """공유 스냅샷 조회 (만료 시 변경 토큰이 그대로면 전체 조회 없이 기존 스냅샷 사용)"""
+        probe = {}
+
+        def unchanged(table):
+            probe["version"] = self.backend.get_customer_version(cache_key)
+            return probe["version"] is not None and probe["version"] == table.attrs.get("version")
+
+        def load():
+            # 토큰을 먼저 읽어야 조회 중에 바뀐 내용이 다음 확인에서 감지됨
+            version = probe["version"] if "version" in probe else self.backend.get_customer_version(cache_key)
+            table = build_customer_table(trace_rows(self.backend.get_customer_values(cache_key)))
+            table.attrs["version"] = version
+            table.attrs["loaded_at"] = time.monotonic()
+            return table
+
+        return self.customer_cache.get(cache_key, load, revalidate=unchanged)
+
+    @traced
+    def get_customer_version(self, store_code=None):
+        """고객 데이터 버전 (값이 바뀌었을 때만 다시 조회하기 위한 비교용)
+
+        저장소의 변경 토큰에 스냅샷을 로드한 시각을 더하므로, 토큰이 없거나 그대로여도
+        스냅샷을 다시 읽으면(쓰기 후, TTL 만료, 주기적 전체 재조회) 값이 바뀝니다.
+        """
+        # 만료된 스냅샷은 여기서 변경 토큰을 확인하고 필요할 때만 다시 로드됨
+        cache_key = store_code if self.backend.supports_store_filter else None
+        pending = tuple((row[0], row[5]) for row in self._pending_rows(store_code))
+        pending += tuple(sorted(self._status_overrides().items()))
+        try:
+            table = self._read_values("customers", lambda: self._load_customer_table(cache_key), cache_key)
+        except Exception:
+            return None
+        version = (table.attrs.get("version"), table.attrs.get("loaded_at"))
+        return version + (pending,) if pending else version
+
+    @traced
     def get_customers(self, store_code=None):
         """고객 목록 조회"""
         try:
-            sheet = self.workbook.worksheet("customers")
-            all_values = sheet.get_all_values()
-            
-            if not all_values or len(all_values) < 2:
-                return []
-            
-            headers = all_values[0]
-            data = []
-            
-            for i, row in enumerate(all_values[1:], start=2):
-                try:
-                    if not any(cell.strip() for cell in row if cell):
-                        continue
-                    
-                    while len(row) < len(headers):
-                        row.append('')
-                    
-                    row_dict = {}
-                    for j, header in enumerate(headers):
-                        if j < len(row):
-                            row_dict[header] = row[j]
-                        else:
-                            row_dict[header] = ''
-                    
-                    if not row_dict.get('id') or not row_dict.get('name'):
-                        continue
-                    
-                    try:
-                        row_dict['id'] = int(row_dict['id']) if row_dict['id'].isdigit() else 0
-                    except (ValueError, AttributeError):
-                        row_dict['id'] = 0
-                    
-                    # store_ticket_number 처리
-                    if row_dict.get('store_ticket_number'):
-                        try:
-                            row_dict['store_ticket_number'] = int(row_dict['store_ticket_number'])
-                        except (ValueError, TypeError):
-                            row_dict['store_ticket_number'] = 0
-                    else:
-                        row_dict['store_ticket_number'] = 0
-                    
-                    if not row_dict.get('status'):
-                        row_dict['status'] = '대기'
-                    if not row_dict.get('store_code'):
-                        row_dict['store_code'] = 'UNKNOWN'
-                    if not row_dict.get('service_type'):
-                        row_dict['service_type'] = '기타'
-                    
-                    data.append(row_dict)
-                    
-                except Exception as e:
-                    continue
-            
-            if store_code:
-                data = [row for row in data if row.get('store_code') == store_code]
-            
-            # datetime 변환
-            for row in data:
-                if row.get('registered_time'):
-                    try:
-                        time_str = row['registered_time']
-                        row['registered_time'] = datetime.strptime(time_str, "%y-%m-%d, %I:%M %p")
-                    except:
-                        try:
-                            if 'T' in time_str:
-                                row['registered_time'] = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-                            else:
-                                row['registered_time'] = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-                        except:
-                            row['registered_time'] = datetime.now()
-                else:
-                    row['registered_time'] = datetime.now()
-            
-            return data
-            
-        except gspread.exceptions.WorksheetNotFound:
-            return []
+            return customer_records(self.get_customer_table(store_code))
         except Exception as e:
             return []
     
+    def _load_ticket_stats(self):
+        """집계를 먼저 읽어 둠 (저장된 집계가 없을 때 이번 변경이 두 번 세어지지 않도록 쓰기 전에 호출)"""
+        try:
+            # 읽기에 실패하면 빈 테이블로 채우지 않고 다음 호출에서 다시 시도
+            self.ticket_stats.ensure_loaded(self._read_customer_table)
+        except Exception:
+            pass
+        try:
+            self.wait_estimator.ensure_loaded(self._read_customer_table, self._status_event_frame)
+        except Exception:
+            pass
+
+    def _status_event_frame(self):
+        self.status_events.ensure_loaded()
+        return self.status_events.frame()
+
+    def estimate_wait(self, store_code):
+        """(대기 인원, 예상 대기 시간(분)), 현황을 알 수 없으면 (None, None)"""
+        self._load_ticket_stats()
+        # 공유 스냅샷이 만료되었으면 다시 로드되면서 인원이 맞춰짐 (유효하면 메모리에서 바로 반환)
+        self.get_customer_table(store_code)
+        return self.wait_estimator.estimate(store_code)
+
+    def get_queue_counts(self):
+        """{매장 코드: (대기 인원, 처리중 인원)} (예상 대기 시간과 같은 값, 현황을 알 수 없으면 None)"""
+        self._load_ticket_stats()
+        return self.wait_estimator.queue_counts()
+
+    def get_ticket_stats(self, start_date=None, end_date=None, store_codes=None, by=("date",)):
+        """기간별 발급/완료 건수 (DataFrame, by 열별 합계)"""
+        self._load_ticket_stats()
+        return self.ticket_stats.query(start_date, end_date, store_codes, by)
+
+    @traced
     def add_customer(self, name, phone, service_type, store_code):
         """새 고객 추가 - 매장별 티켓 번호 관리"""
+        pipeline = self.backend.registration_pipeline
+        self._load_ticket_stats()
         try:
-            sheet = self.workbook.worksheet("customers")
-            all_values = sheet.get_all_values()
-            
-            # 헤더가 없으면 추가
-            if not all_values:
-                headers = ["id", "name", "phone", "service_type", "registered_time", "status", "store_code", "estimated_time", "store_ticket_number"]
-                sheet.append_row(headers)
-                all_values = [headers]
-            
-            # 헤더에 store_ticket_number 컬럼이 없으면 추가
-            headers = all_values[0]
-            if "store_ticket_number" not in headers:
-                headers.append("store_ticket_number")
-                sheet.update('A1:I1', [headers])
-            
-            # 전체 ID와 매장별 티켓 번호 계산
-            new_id = 1
-            store_ticket_number = 1
-            
-            if len(all_values) > 1:
-                try:
-                    existing_ids = []
-                    store_ticket_numbers = []
-                    
-                    for row in all_values[1:]:
-                        if row and len(row) > 0:
-                            # 전체 ID 수집
-                            if row[0]:
-                                try:
-                                    existing_ids.append(int(row[0]))
-                                except (ValueError, IndexError):
-                                    continue
-                            
-                            # 같은 매장의 티켓 번호 수집
-                            if len(row) > 6 and row[6] == store_code:
-                                # store_ticket_number가 있는 경우
-                                if len(row) > 8 and row[8]:
-                                    try:
-                                        store_ticket_numbers.append(int(row[8]))
-                                    except (ValueError, IndexError):
-                                        continue
-                    
-                    # 새 전체 ID 생성
-                    if existing_ids:
-                        new_id = max(existing_ids) + 1
-                    else:
-                        new_id = 1
-                    
-                    # 새 매장별 티켓 번호 생성
-                    if store_ticket_numbers:
-                        store_ticket_number = max(store_ticket_numbers) + 1
-                    else:
-                        store_ticket_number = 1
-                        
-                except Exception as e:
-                    new_id = len(all_values)
-                    store_ticket_number = 1
-            
             # 예상 시간 계산
-            estimated_time = 3 if service_type in ["유심교체", "유심재설정"] else 10
-            current_time = format_korean_datetime()
-            
-            # 새 행 데이터 준비
-            new_row = [
-                str(new_id),
-                str(name),
-                str(phone),
-                str(service_type),
-                current_time,
-                "대기",
-                str(store_code),
-                str(estimated_time),
-                str(store_ticket_number)
-            ]
+            estimated_time = estimated_service_minutes(service_type)
+            registered_at = datetime.now(pytz.timezone('Asia/Seoul')).replace(tzinfo=None)
+            current_time = format_korean_datetime(registered_at)
             
-            # 행 추가
-            sheet.append_row(new_row)
+            if pipeline is not None:
+                # 번호만 바로 발급하고 저장은 파이프라인이 묶어서 처리 (저장 전까지 '저장 대기'로 조회됨)
+                new_row = self.backend.prepare_customer(
+                    name, phone, service_type, store_code, current_time, estimated_time
+                )
+                future = pipeline.submit(new_row)
+                if pipeline.blocking:
+                    # 같은 묶음이 저장될 때까지 대기 (저장에 실패하면 등록 실패)
+                    future.result()
+                customer_id, store_ticket_number = int(new_row[0]), int(new_row[8])
+            else:
+                customer_id, store_ticket_number = self.backend.add_customer(
+                    name, phone, service_type, store_code, current_time, estimated_time
+                )
+            self._update_phone_index(
+                store_code, lambda index: index.add(store_code, phone, customer_id, "대기", korea_today())
+            )
+            # 분 단위로 저장되는 등록 시간과 같은 칸에 더함
+            self.ticket_stats.record(store_code, registered_at, service_type, issued=1)
+            self.wait_estimator.record_issue(store_code, service_type)
+            operational_metrics.record_registration(store_code)
             return store_ticket_number
-            
-        except gspread.exceptions.WorksheetNotFound:
-            try:
-                customers_sheet = self.workbook.add_worksheet(title="customers", rows="1000", cols="10")
-                headers = ["id", "name", "phone", "service_type", "registered_time", "status", "store_code", "estimated_time", "store_ticket_number"]
-                customers_sheet.append_row(headers)
-                return self.add_customer(name, phone, service_type, store_code)
-            except Exception as create_error:
-                return None
                 
         except Exception as e:
             return None
+        finally:
+            if pipeline is None:
+                self.customer_cache.invalidate()
+                self._forget_values("customers")
     
+    @traced
     def get_settings(self):
         """설정 조회"""
         try:
-            sheet = self.workbook.worksheet("settings")
-            all_values = sheet.get_all_values()
+            all_values = self._read_values("settings", lambda: trace_rows(self.backend.get_settings_values()))
             
             if not all_values or len(all_values) < 2:
                 return {
@@ -466,77 +3334,183 @@ class SheetsManager:
 
     def get_teams(self):
         """모든 팀 목록 가져오기"""
-        stores = self.get_all_stores()
-        teams = list(set([store['team'] for store in stores if store.get('team')]))
-        return sorted(teams)
+        return list(self.get_store_directory().teams)
     
     def get_stores_by_team(self, team):
         """특정 팀의 매장들 가져오기"""
-        stores = self.get_all_stores()
-        team_stores = [store for store in stores if store.get('team') == team]
-        return team_stores
+        return list(self.get_store_directory().by_team.get(team, []))
     
     def get_store_by_name(self, store_name):
         """매장명으로 매장 정보 찾기"""
-        stores = self.get_all_stores()
-        for store in stores:
-            if store.get('store_name') == store_name:
-                return store
-        return None
+        return self.get_store_directory().by_name.get(store_name)
     
     def set_store_admin_by_name(self, store_name, admin_id, admin_pw):
         """매장명으로 관리자 정보 설정"""
-        sheet = self.workbook.worksheet("stores")
-        all_values = sheet.get_all_values()
-        headers = all_values[0]
-        
         try:
-            store_name_idx = headers.index("store_name")
-            admin_id_idx = headers.index("admin_id")
-            admin_pw_idx = headers.index("admin_pw")
-        except ValueError:
-            return False
-            
-        for i, row in enumerate(all_values[1:], start=2):
-            if row[store_name_idx] == store_name:
-                sheet.update_cell(i, admin_id_idx + 1, admin_id)
-                sheet.update_cell(i, admin_pw_idx + 1, admin_pw)
-                return True
-        return False
+            return self.backend.set_store_admin(store_name, admin_id, admin_pw)
+        finally:
+            self.store_cache.invalidate()
+            self._forget_values("stores")
+
+    def archive_customers(self, keep_days=None, partition=None, include_stale_waiting=None):
+        """오래된 완료(및 대기) 고객을 기간별 보관 시트로 이동 (이동한 행 수 반환)"""
+        config = get_storage_config()
+        keep_days = keep_days or config["archive_keep_days"] or 1
+        partition = partition or config["archive_partition"]
+        if include_stale_waiting is None:
+            include_stale_waiting = config["archive_stale_waiting"]
 
-    def update_customer_status(self, customer_id, new_status):
-        """고객 상태 업데이트"""
+        # 오늘 포함 keep_days일 전 자정보다 먼저 등록된 고객이 대상
+        cutoff = datetime.combine(korea_today() - timedelta(days=keep_days - 1), datetime.min.time())
+        statuses = ('완료', '대기') if include_stale_waiting else ('완료',)
         try:
-            sheet = self.workbook.worksheet("customers")
-            all_values = sheet.get_all_values()
-            headers = all_values[0]
-            for i, row in enumerate(all_values[1:], start=2):
-                if row[0] == str(customer_id):
-                    sheet.update_cell(i, headers.index('status') + 1, new_status)
-                    break
-        except Exception as e:
-            st.error(f"상태 업데이트 오류: {str(e)}")
+            return self.backend.archive_customers(cutoff, statuses, partition)
+        finally:
+            self.customer_cache.invalidate()
+            self.phone_index_cache.invalidate()
+            self._forget_values("customers")
+
+    def get_phone_index(self, store_code=None):
+        """매장별 전화번호 색인 (프로세스 전역 캐시, 등록/상태 변경 시 바로 갱신)
+
+        매장별로 조회할 수 있는 저장소는 해당 매장의 고객만으로 색인을 만들어 다른 매장 시트를 읽지 않습니다.
+        고객 데이터를 읽지 못하면 예외를 그대로 전달하므로 빈 색인이 캐시되어 중복 확인이 꺼지지 않습니다.
+        """
+        cache_key = store_code if self.backend.supports_store_filter else None
+        return self.phone_index_cache.get(
+            cache_key, lambda: PhoneIndex.from_table(self._read_customer_table(cache_key))
+        )
+
+    def _update_phone_index(self, store_code, update):
+        """저장이 끝난 변경을 전화번호 색인에 반영 (색인을 만들지 못하면 다음 조회 때 새로 만듦)"""
+        try:
+            update(self.get_phone_index(store_code))
+        except Exception:
+            self.phone_index_cache.invalidate()
+
+    @traced
+    def update_customer_status(self, customer_id, new_status, store_code=None, admin_id=None, counter=None):
+        """고객 상태 업데이트 (admin_id, counter: 처리한 관리자와 창구, 상태 변경 기록에 남음)"""
+        self._load_ticket_stats()
+        previous = self._customer_row(customer_id, store_code)
+        changed_at = datetime.now(pytz.timezone('Asia/Seoul')).replace(tzinfo=None)
+
+        def record_change():
+            self._record_status_change(customer_id, new_status, store_code, previous, admin_id, counter, changed_at)
+
+        pipeline = self.backend.registration_pipeline
+        status_writer = self.backend.status_writer
+        updated = False
+        if pipeline is not None and pipeline.update_status(customer_id, new_status):
+            # 아직 저장 전인 고객은 저장 대기 행만 바꾸고, 저장할 때 함께 반영
+            updated = True
+        elif status_writer is not None:
+            # 조회 결과에는 바로 반영하고 시트 저장은 모아서 처리
+            # (기록과 집계는 저장이 확인된 뒤 반영, 실패하면 pop_failed_status_writes로 알림)
+            status_writer.submit(customer_id, new_status, store_code, on_saved=record_change)
+            return
+        else:
+            try:
+                updated = self.backend.update_customer_status(customer_id, new_status, store_code)
+            except Exception as e:
+                st.error(f"상태 업데이트 오류: {str(e)}")
+            finally:
+                self.customer_cache.invalidate()
+                self._forget_values("customers")
+
+        if not updated:
+            return
+        record_change()
+
+    def _record_status_change(self, customer_id, new_status, store_code, previous, admin_id, counter, changed_at):
+        """저장된 상태 변경을 전화번호 색인, 예상 대기 시간, 상태 변경 기록, 완료 집계에 반영"""
+        if previous is not None:
+            store_code = previous['store_code']
+        self._update_phone_index(store_code, lambda index: index.set_status(customer_id, new_status))
+        if previous is None or previous['status'] == new_status:
+            return
+        self.wait_estimator.record_status(
+            customer_id, previous['store_code'], previous['service_type'], previous['status'], new_status,
+            counter or admin_id, changed_at
+        )
+        # 등록 시간을 알 수 없어도 처리 시간은 계산할 수 있으므로 빈 등록 시간으로 기록
+        registered_time = None if pd.isna(previous['registered_time']) else previous['registered_time']
+        self.status_events.record(
+            customer_id, previous['store_code'], previous['service_type'], registered_time,
+            new_status, admin_id, counter, changed_at
+        )
+        if registered_time is None:
+            return
+        completed = (new_status == '완료') - (previous['status'] == '완료')
+        if completed:
+            self.ticket_stats.record(
+                previous['store_code'], previous['registered_time'], previous['service_type'],
+                completed=completed
+            )
+
+    def pop_failed_status_writes(self, store_code=None):
+        """시트에서 고객을 찾지 못해 저장하지 못한 [(고객 ID, 상태)] (한 번 가져가면 지워짐)"""
+        status_writer = self.backend.status_writer
+        return status_writer.pop_failed(store_code) if status_writer is not None else []
+
+    def archive_status_events(self, keep_days=None, partition=None):
+        """오래된 상태 변경 기록을 기간별 보관 시트로 이동 (이동한 행 수 반환)"""
+        config = get_storage_config()
+        keep_days = keep_days or config["status_event_keep_days"] or 1
+        partition = partition or config["archive_partition"]
+
+        # 처리 시간 분석은 최근 keep_days일의 기록만 사용
+        cutoff = datetime.combine(korea_today() - timedelta(days=keep_days - 1), datetime.min.time())
+        # 저장 전 기록을 먼저 저장해야 보관 대상에서 빠지지 않음
+        self.status_events.flush()
+        archived = self.backend.archive_status_events(cutoff, partition)
+        self.status_events.forget_before(cutoff)
+        return archived
+
+    def get_service_metrics(self, store_code, start_date=None, end_date=None):
+        """매장 처리 시간 지표 (summarize_service_times 참고)"""
+        try:
+            self.status_events.ensure_loaded()
+        except Exception:
+            pass
+        return summarize_service_times(self.status_events.frame(), store_code, start_date, end_date)
+
+    def _customer_row(self, customer_id, store_code=None):
+        """고객 ID로 현재 행 조회 (없으면 None)"""
+        try:
+            table = self.get_customer_table(store_code)
+            matches = table[table['id'] == int(customer_id)]
+            return None if matches.empty else matches.iloc[0]
+        except Exception:
+            return None
 
     def get_store_ticket_numbers(self, store_code):
         """특정 매장의 티켓 번호 목록 조회"""
         try:
-            customers = self.get_customers(store_code)
-            ticket_numbers = []
-            
-            for customer in customers:
-                if customer.get('store_ticket_number'):
-                    try:
-                        ticket_numbers.append(int(customer['store_ticket_number']))
-                    except (ValueError, TypeError):
-                        continue
-            
-            return sorted(ticket_numbers)
+            tickets = self.get_customer_table(store_code)['store_ticket_number']
+            return sorted(tickets[tickets > 0].tolist())
         except Exception as e:
             return []
 
+    def get_next_store_ticket_numbers(self, store_codes):
+        """여러 매장의 다음 티켓 번호를 한 번에 미리보기 ({매장 코드: 번호})"""
+        next_tickets = {store_code: self.backend.peek_next_ticket(store_code) for store_code in store_codes}
+        unknown = [store_code for store_code, ticket in next_tickets.items() if ticket is None]
+        if unknown:
+            # 백엔드가 바로 알 수 없으면 스냅샷 한 번으로 매장별 최대 번호를 구함
+            customers = self.get_customer_table()
+            max_tickets = customers.groupby('store_code', observed=True)['store_ticket_number'].max()
+            for store_code in unknown:
+                next_tickets[store_code] = int(max_tickets.get(store_code, 0)) + 1
+        return next_tickets
+
     def get_next_store_ticket_number(self, store_code):
         """특정 매장의 다음 티켓 번호 미리보기"""
         try:
+            next_ticket = self.backend.peek_next_ticket(store_code)
+            if next_ticket is not None:
+                return next_ticket
+
             ticket_numbers = self.get_store_ticket_numbers(store_code)
             if ticket_numbers:
                 return max(ticket_numbers) + 1
@@ -563,25 +3537,11 @@ def get_store_name(store_code, sheets_manager):
 def get_current_status(store_code, sheets_manager):
     """현재 대기 현황 가져오기"""
     try:
-        customers = sheets_manager.get_customers(store_code)
-        waiting_customers = [c for c in customers if c['status'] == '대기']
-        waiting_count = len(waiting_customers)
-        
-        # 대기 중인 고객들의 예상 시간 합계
-        total_estimated_time = 0
-        for customer in waiting_customers:
-            estimated_time = int(customer.get('estimated_time', 5))
-            total_estimated_time += estimated_time
-        
-        # 기본 대기시간 추가
-        total_estimated_time += random.randint(0, 5)
-        
-        return waiting_count, total_estimated_time
+        # 매장별로 유지하는 대기 인원과 처리 시간 평균으로 계산 (고객 데이터를 훑지 않음)
+        return sheets_manager.estimate_wait(store_code)
     except Exception as e:
-        # 오류 시 기본값 반환
-        waiting = random.randint(1, 5)
-        time_estimate = waiting * 5 + random.randint(2, 8)
-        return waiting, time_estimate
+        # 현황을 알 수 없으면 임의의 값 대신 None
+        return None, None
 
 def validate_input(phone, name):
     """입력 검증"""
@@ -609,11 +3569,9 @@ def register_customer(phone, name, store_code, service_type, sheets_manager):
         stored_phone = formatted_phone
         
         # 중복 확인
-        existing_customers = sheets_manager.get_customers(store_code)
-        
-        for customer in existing_customers:
-            if is_phone_duplicate(customer['phone'], formatted_phone):
-                return None, "이미 등록된 전화번호입니다."
+        duplicate_scope = get_storage_config()["duplicate_scope"]
+        if sheets_manager.get_phone_index(store_code).contains(store_code, formatted_phone, duplicate_scope):
+            return None, "이미 등록된 전화번호입니다."
         
         # 고객 추가
         store_ticket_number = sheets_manager.add_customer(masked_name, stored_phone, service_type, store_code)
@@ -642,12 +3600,12 @@ def show_input_screen(store_name, store_code):
         st.session_state.ticket_time = None
     
     # SheetsManager 인스턴스 가져오기
-    workbook, client = init_google_sheets()
-    if workbook is None:
+    backend = init_storage_backend()
+    if backend is None:
         st.error("🔧 Google Sheets 설정이 필요합니다.")
         return
     
-    sheets_manager = SheetsManager(workbook)
+    sheets_manager = SheetsManager(backend)
     
     if st.session_state.show_ticket:
         show_ticket_screen()
@@ -657,8 +3615,10 @@ def show_input_screen(store_name, store_code):
 def show_customer_input_form(store_name, store_code, sheets_manager):
     """고객 정보 입력 폼"""
     
-    # 현재 대기 현황
+    # 현재 대기 현황 (알 수 없으면 "-"로 표시)
     waiting_count, estimated_time = get_current_status(store_code, sheets_manager)
+    waiting_text = "-" if waiting_count is None else f"{waiting_count}명"
+    estimated_text = "-" if estimated_time is None else f"약 {estimated_time}분"
     
     # 다음 티켓 번호 미리보기
     next_ticket = sheets_manager.get_next_store_ticket_number(store_code)
@@ -680,7 +3640,7 @@ def show_customer_input_form(store_name, store_code, sheets_manager):
         st.markdown(f"""
         <div style="text-align: center; padding: 20px; background: rgba(102, 126, 234, 0.05); border-radius: 15px; margin: 5px;">
             <p style="margin: 5px 0; font-size: 1.1rem; color: #666;">현재 대기</p>
-            <p style="margin: 5px 0; font-size: 2.2rem; font-weight: bold; color: #667eea;">{waiting_count}명</p>
+            <p style="margin: 5px 0; font-size: 2.2rem; font-weight: bold; color: #667eea;">{waiting_text}</p>
         </div>
         """, unsafe_allow_html=True)
     
@@ -688,7 +3648,7 @@ def show_customer_input_form(store_name, store_code, sheets_manager):
         st.markdown(f"""
         <div style="text-align: center; padding: 20px; background: rgba(102, 126, 234, 0.05); border-radius: 15px; margin: 5px;">
             <p style="margin: 5px 0; font-size: 1.1rem; color: #666;">예상 시간</p>
-            <p style="margin: 5px 0; font-size: 2.2rem; font-weight: bold; color: #667eea;">약 {estimated_time}분</p>
+            <p style="margin: 5px 0; font-size: 2.2rem; font-weight: bold; color: #667eea;">{estimated_text}</p>
         </div>
         """, unsafe_allow_html=True)
     
@@ -787,7 +3747,6 @@ def show_customer_input_form(store_name, store_code, sheets_manager):
                         st.session_state.ticket_number = store_ticket_number
                         st.session_state.show_ticket = True
                         st.session_state.ticket_time = time.time()
-                        time.sleep(2)
                         st.rerun()
                     else:
                         st.error(f"❌ {result_message}")
@@ -839,9 +3798,8 @@ def show_ticket_screen():
         remaining = max(0, 5 - int(elapsed))
         
         if remaining > 0:
-            st.info(f"⏰ {remaining}초 후 자동으로 처음 화면으로 돌아갑니다...")
-            time.sleep(1)
-            st.rerun()
+            # 카운트다운은 브라우저에서 진행하고, 끝나면 돌아가기 버튼을 눌러 한 번만 서버로 요청
+            show_return_countdown(remaining, "처음으로 돌아가기")
         else:
             # 5초가 지나면 자동으로 초기화
             st.session_state.show_ticket = False
@@ -849,6 +3807,33 @@ def show_ticket_screen():
             st.session_state.ticket_time = None
             st.rerun()
 
+def show_return_countdown(seconds, button_label):
+    """브라우저에서 카운트다운 후 button_label이 적힌 버튼을 누름 (서버 스레드를 붙잡지 않음)"""
+    components.html(f"""
+    <div style="font-family: sans-serif; padding: 14px 16px; border-radius: 8px;
+                background: rgba(28, 131, 225, 0.1); color: #1c83e1;">
+        ⏰ <span id="remaining">{seconds}</span>초 후 자동으로 처음 화면으로 돌아갑니다...
+    </div>
+    <script>
+    let remaining = {seconds};
+    const timer = setInterval(function() {{
+        remaining -= 1;
+        if (remaining > 0) {{
+            document.getElementById("remaining").textContent = remaining;
+            return;
+        }}
+        clearInterval(timer);
+        const buttons = window.parent.document.querySelectorAll("button");
+        for (const button of buttons) {{
+            if (button.innerText.includes("{button_label}")) {{
+                button.click();
+                break;
+            }}
+        }}
+    }}, 1000);
+    </script>
+    """, height=70)
+
 # 메인 함수
 def main():
     """메인 함수"""
@@ -861,37 +3846,51 @@ def main():
     # 매장 정보 설정
     store_code = st.query_params.get("store", "STORE001")
     
-    # Google Sheets 연결
-    workbook, client = init_google_sheets()
-    if workbook is None:
+    # 저장소 연결
+    backend = init_storage_backend()
+    if backend is None:
         st.error("🔧 Google Sheets 설정이 필요합니다.")
         st.stop()
     
-    sheets_manager = SheetsManager(workbook)
-    store_name = get_store_name(store_code, sheets_manager)
-    
-    # 고객 입력 화면 표시
-    show_input_screen(store_name, store_code)
+    # 한 번의 실행에서 시트 조회 결과 공유
+    with request_scope():
+        sheets_manager = SheetsManager(backend)
+        store_name = get_store_name(store_code, sheets_manager)
+        
+        # 고객 입력 화면 표시
+        show_input_screen(store_name, store_code)
 
 # 추가 유틸리티 함수들
 def get_store_waiting_summary(sheets_manager):
-    """모든 매장의 대기 현황 요약"""
+    """모든 매장의 대기 현황 요약 (고객 스냅샷 한 번을 매장별로 한 번에 집계)"""
     try:
         all_stores = sheets_manager.get_all_stores()
-        summary = []
+        # 전체 스냅샷을 읽으면서 예상 대기 시간의 인원도 맞춰짐
+        customers = sheets_manager.get_customer_table()
+        # 인원과 예상 시간을 같은 값(고객 화면과 동일)에서 가져옴
+        queue_counts = sheets_manager.get_queue_counts()
+        if queue_counts is None:
+            # 예상 시간을 계산할 수 없으면 인원만 스냅샷으로 표시하고 예상 시간은 비워 둠
+            waiting, processing = WaitEstimator._queue_counts(customers)
+            queue_counts = {
+                store_code: (sum(waiting.get(store_code, {}).values()), processing.get(store_code, 0))
+                for store_code in set(waiting) | set(processing)
+            }
         
+        next_tickets = sheets_manager.get_next_store_ticket_numbers([store['store_code'] for store in all_stores])
+        
+        summary = []
         for store in all_stores:
             store_code = store['store_code']
-            store_name = store['store_name']
-            waiting_count, estimated_time = get_current_status(store_code, sheets_manager)
-            next_ticket = sheets_manager.get_next_store_ticket_number(store_code)
-            
+            waiting_count, processing_count = queue_counts.get(store_code, (0, 0))
             summary.append({
                 'store_code': store_code,
-                'store_name': store_name,
+                'store_name': store['store_name'],
+                'team': store.get('team', ''),
                 'waiting_count': waiting_count,
-                'estimated_time': estimated_time,
-                'next_ticket': next_ticket
+                'processing_count': processing_count,
+                'estimated_time': sheets_manager.wait_estimator.estimate(store_code)[1],
+                'next_ticket': next_tickets[store_code]
             })
         
         return summary
@@ -901,26 +3900,53 @@ def get_store_waiting_summary(sheets_manager):
 def get_store_ticket_history(store_code, sheets_manager, days=7):
     """특정 매장의 최근 티켓 발급 이력"""
     try:
-        customers = sheets_manager.get_customers(store_code)
-        
-        # 최근 N일간 데이터 필터링
-        cutoff_date = datetime.now() - timedelta(days=days)
-        recent_customers = [
-            c for c in customers 
-            if c.get('registered_time') and c['registered_time'] >= cutoff_date
-        ]
-        
-        # 날짜별 발급 수 집계
-        daily_counts = {}
-        for customer in recent_customers:
-            date_key = customer['registered_time'].strftime('%Y-%m-%d')
-            if date_key not in daily_counts:
-                daily_counts[date_key] = 0
-            daily_counts[date_key] += 1
-        
-        return daily_counts
+        # 고객 데이터를 다시 훑지 않고 발급 집계에서 날짜별 합계만 조회
+        end_date = korea_today()
+        start_date = end_date - timedelta(days=days)
+        daily_counts = sheets_manager.get_ticket_stats(start_date, end_date, [store_code], by=("date",))
+        daily_counts = daily_counts[daily_counts['issued'] > 0]
+        return dict(zip(daily_counts['date'], daily_counts['issued'].astype(int)))
     except Exception as e:
         return {}
 
+def split_customers_command():
+    """기존 customers 시트를 매장(팀)별 시트로 나누는 명령 (python Home.py split-customers)"""
+    backend = init_storage_backend()
+    if not isinstance(backend, GoogleSheetsBackend):
+        print("Google Sheets 저장소에서만 사용할 수 있습니다.")
+        return
+    if backend.layout == "single":
+        print("customer_sheet_layout을 store 또는 team으로 설정한 뒤 실행하세요.")
+        return
+
+    for title, count in backend.split_customers().items():
+        print(f"{title}: {count}행 복사")
+
+def import_sqlite_command(store_csv, settings_csv=None):
+    """CSV(시트와 같은 헤더)로 비어 있는 SQLite stores/settings 테이블 채우기 (python Home.py import-sqlite)"""
+    config = get_storage_config()
+    if config["backend"] != "sqlite":
+        print("backend를 sqlite로 설정한 뒤 실행하세요.")
+        return
+
+    def csv_values(path):
+        def load():
+            with open(path, newline='', encoding='utf-8-sig') as f:
+                return [row for row in csv.reader(f)]
+        return load
+
+    backend = SQLiteBackend(config["sqlite_path"])
+    seeded = backend.seed(csv_values(store_csv), csv_values(settings_csv) if settings_csv else None)
+    for table in ("stores", "settings"):
+        if table in seeded:
+            print(f"{table}: 가져옴")
+        elif table == "stores" or settings_csv:
+            print(f"{table}: 이미 데이터가 있어 건너뜀")
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "split-customers":
+        split_customers_command()
+    elif len(sys.argv) > 2 and sys.argv[1] == "import-sqlite":
+        import_sqlite_command(*sys.argv[2:4])
+    else:
+        main()
@@ -9,6 +9,16 @@ Disallow: /""")
 except:
     pass
 
+# Prometheus 수집용 /metrics HTTP 서버 (metrics_port 설정 시, 프로세스당 한 번 시작)
+from Home import init_metrics_server
+init_metrics_server()
+
+# 운영 지표 (?metrics) - 메모리에 있는 값만 사용하므로 시트를 읽지 않음
+if 'metrics' in st.query_params:
+    from Home import render_metrics
+    st.text(render_metrics())
+    st.stop()
+
 st.set_page_config(
     page_title="유심 교체 대기 등록",
     page_icon="📱",
@@ -316,11 +326,17 @@ st.markdown("""
     </script>
 """, unsafe_allow_html=True)
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
 import time
-import io
-from Home import init_google_sheets, SheetsManager, get_store_name, mask_phone
+from Home import (
+    init_storage_backend, request_scope, trace_scope, SheetsManager, customer_records, get_store_name, mask_phone,
+    EXPORT_FORMATS, available_export_formats, filter_by_registered_date, export_customer_table,
+    get_store_waiting_summary, korea_today, estimated_service_minutes
+)
+
+# 관리자 대기열 자동 새로고침 주기 (초)
+ADMIN_QUEUE_REFRESH_SECONDS = 10
 
 # 권한 확인 함수
 def check_admin_permission():
@@ -337,13 +353,8 @@ def show_admin_view(sheets_manager, store_code=None):
     if not check_admin_permission():
         return
     
-    # 자동 새로고침 및 다크모드 최적화
+    # 다크모드 최적화
     st.markdown("""
-        <script>
-        setTimeout(function() {
-            window.location.reload();
-        }, 30000);
-        </script>
         <style>
         /* 다크모드에서 고객 카드 색상 최적화 */
         @media (prefers-color-scheme: dark) {
@@ -370,11 +381,11 @@ def show_admin_view(sheets_manager, store_code=None):
         st.warning("❗ 먼저 '로그인' 탭에서 매장을 선택해주세요.")
         return
 
+    # 상태 변경 기록에 함께 남길 창구 (선택)
+    st.text_input("🪟 창구 번호 (선택)", key="admin_counter")
+
     # 전체 고객 데이터 가져오기 (모든 상태 포함)
-    all_customers = [c for c in sheets_manager.get_customers() if c.get('store_code') == store_code]
-    
-    # 화면 표시용 (대기, 처리중만)
-    filtered_for_display = [c for c in all_customers if c['status'] in ['대기', '처리중']]
+    customer_table = sheets_manager.get_customer_table(store_code)
 
     if st.button("🔄 새로고침"):
         st.rerun()
@@ -382,32 +393,109 @@ def show_admin_view(sheets_manager, store_code=None):
     st.markdown("---")
     st.caption("테이블에서 직접 상태를 변경하세요:")
 
-    # 엑셀 다운로드 버튼 - 전체 데이터로 변경
-    if all_customers:
-        df_all = pd.DataFrame(all_customers)
-        df_all['registered_time'] = pd.to_datetime(df_all['registered_time'], errors='coerce')
-        df_all = df_all.sort_values(by='registered_time')
-        
-        # 상태별 개수 표시
-        status_counts = df_all['status'].value_counts()
-        st.info(f"📊 전체 현황: 대기 {status_counts.get('대기', 0)}명 | 처리중 {status_counts.get('처리중', 0)}명 | 완료 {status_counts.get('완료', 0)}명")
-        
-        excel_buffer = io.BytesIO()
-        writer = pd.ExcelWriter(excel_buffer, engine='xlsxwriter')
-        df_all.to_excel(writer, index=False, sheet_name='전체 고객 목록')
-        writer.close()
-        
-        st.download_button(
-            label="📥 전체 고객 엑셀 다운로드 (대기+처리중+완료)",
-            data=excel_buffer.getvalue(),
-            file_name=f"전체_고객_목록_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    # 전체 고객 다운로드 (대기+처리중+완료) - 요청할 때만 파일 생성
+    if not customer_table.empty:
+        show_customer_export(sheets_manager, store_code, customer_table)
     else:
         st.info("다운로드할 데이터가 없습니다.")
 
+    show_service_metrics(sheets_manager, store_code)
+    show_admin_queue(sheets_manager, store_code)
+
+# 내보내기 파일은 데이터 버전별로 캐시 (같은 데이터·조건이면 다시 만들지 않음)
+@st.cache_data(max_entries=16, show_spinner=False)
+def build_customer_export(_customer_table, store_code, version, start_date, end_date, file_format):
+    return export_customer_table(filter_by_registered_date(_customer_table, start_date, end_date), file_format)
+
+def show_customer_export(sheets_manager, store_code, customer_table):
+    with st.expander("📥 전체 고객 다운로드 (대기+처리중+완료)"):
+        registered_times = customer_table['registered_time'].dropna()
+        today = korea_today()
+        first_date = registered_times.min().date() if not registered_times.empty else today
+
+        date_range = st.date_input("등록 기간", value=(first_date, today), key="export_date_range")
+        # 기간을 고르는 중에는 시작일만 넘어옴
+        if isinstance(date_range, (tuple, list)):
+            start_date = date_range[0] if date_range else None
+            end_date = date_range[1] if len(date_range) > 1 else start_date
+        else:
+            start_date = end_date = date_range
+        # 전체 기간이면 거르지 않음 (등록 시간을 알 수 없는 고객도 포함)
+        if start_date is not None and start_date <= first_date and end_date is not None and end_date >= today:
+            start_date = end_date = None
+        unknown_count = len(customer_table) - len(registered_times)
+        if unknown_count:
+            st.caption(f"등록 시간을 알 수 없는 고객 {unknown_count}명은 전체 기간을 선택했을 때만 포함됩니다.")
+        file_format = st.radio(
+            "파일 형식", available_export_formats(),
+            format_func=lambda f: EXPORT_FORMATS[f][0], horizontal=True, key="export_format"
+        )
+
+        request = (store_code, start_date, end_date, file_format)
+        if st.button("📄 파일 만들기", key="export_build"):
+            version = sheets_manager.get_customer_version(store_code)
+            with st.spinner("파일을 만드는 중..."):
+                data = build_customer_export(customer_table, store_code, version, start_date, end_date, file_format)
+            st.session_state["customer_export"] = {
+                "request": request,
+                "data": data,
+                "file_name": f"전체_고객_목록_{datetime.now().strftime('%Y%m%d_%H%M')}.{EXPORT_FORMATS[file_format][1]}",
+            }
+
+        export = st.session_state.get("customer_export")
+        if export and export["request"] == request:
+            st.download_button(
+                label=f"📥 {EXPORT_FORMATS[file_format][0]} 다운로드",
+                data=export["data"],
+                file_name=export["file_name"],
+                mime=EXPORT_FORMATS[file_format][2]
+            )
+
+# 관리자 대기열 (페이지 전체 대신 이 부분만 주기적으로 다시 그림)
+@st.fragment(run_every=ADMIN_QUEUE_REFRESH_SECONDS)
+def show_admin_queue(sheets_manager, store_code):
+    # 상태를 바꾼 관리자와 창구를 기록
+    handled_by = {
+        "admin_id": st.session_state.get("admin_user_id"),
+        "counter": st.session_state.get("admin_counter", "").strip() or None,
+    }
+
+    # 모아서 저장하다 시트에서 고객을 찾지 못한 상태 변경은 되돌려졌음을 알림
+    failed_writes = sheets_manager.pop_failed_status_writes(store_code)
+    if failed_writes:
+        st.error(
+            "⚠️ 시트에서 고객을 찾지 못해 저장하지 못한 상태 변경이 있습니다: "
+            + ", ".join(f"{customer_id}번 → {new_status}" for customer_id, new_status in failed_writes)
+        )
+
+    # 데이터 버전이 그대로면 이전에 조회한 대기열을 그대로 사용
+    version = sheets_manager.get_customer_version(store_code)
+    queue = st.session_state.get("admin_queue")
+    if not queue or queue["store_code"] != store_code or queue["version"] != version:
+        customer_table = sheets_manager.get_customer_table(store_code)
+        queue = {
+            "store_code": store_code,
+            "version": version,
+            "status_counts": customer_table['status'].value_counts().to_dict(),
+            # 화면 표시용 (대기, 처리중만)
+            "customers": customer_records(
+                customer_table[customer_table['status'].isin(['대기', '처리중'])]
+            ),
+        }
+        st.session_state["admin_queue"] = queue
+
+    # 상태별 개수 표시
+    status_counts = queue["status_counts"]
+    if status_counts:
+        st.info(f"📊 전체 현황: 대기 {status_counts.get('대기', 0)}명 | 처리중 {status_counts.get('처리중', 0)}명 | 완료 {status_counts.get('완료', 0)}명")
+
+    # 비동기 등록으로 아직 시트에 저장되지 않은 고객 안내
+    pending_count = sum(1 for customer in queue["customers"] if customer.get('pending_sync'))
+    if pending_count:
+        st.warning(f"⏳ 시트 저장 대기 중인 고객 {pending_count}명 (자동으로 저장됩니다)")
+
     # 화면에는 대기, 처리중인 고객만 표시 (수정된 버튼 로직)
-    for customer in filtered_for_display:
+    for customer in queue["customers"]:
         with st.container():
             status = customer['status']
             # 다크모드를 고려한 색상 설정
@@ -431,7 +519,7 @@ def show_admin_view(sheets_manager, store_code=None):
                         <div style='flex:1;'><strong>ID:</strong> {customer['id']}</div>
                         <div style='flex:2;'><strong>이름:</strong> {customer['name']}</div>
                         <div style='flex:2;'><strong>전화:</strong> {displayed_phone}</div>
-                        <div style='flex:2;'><strong>상태:</strong> {customer['status']}</div>
+                        <div style='flex:2;'><strong>상태:</strong> {customer['status']}{' (⏳ 저장 대기)' if customer.get('pending_sync') else ''}</div>
                         <div style='flex:3;'>""", unsafe_allow_html=True)
 
             # 버튼들을 가로로 배열
@@ -442,9 +530,9 @@ def show_admin_view(sheets_manager, store_code=None):
                 if customer['status'] == '대기':
                     if st.button(f"🟡 대기", key=f"waiting_{customer['id']}", disabled=False):
                         # 대기 상태에서는 처리중으로 변경
-                        sheets_manager.update_customer_status(customer['id'], '처리중')
+                        sheets_manager.update_customer_status(customer['id'], '처리중', store_code, **handled_by)
                         st.success(f"ID {customer['id']} → 처리중")
-                        st.rerun()
+                        st.rerun(scope="fragment")
                 else:
                     st.button(f"⚪ 대기", key=f"waiting_disabled_{customer['id']}", disabled=True)
             
@@ -455,9 +543,9 @@ def show_admin_view(sheets_manager, store_code=None):
                 elif customer['status'] == '대기':
                     if st.button(f"⚪ 처리중", key=f"processing_inactive_{customer['id']}", disabled=False):
                         # 대기에서 바로 처리중으로 이동 가능
-                        sheets_manager.update_customer_status(customer['id'], '처리중')
+                        sheets_manager.update_customer_status(customer['id'], '처리중', store_code, **handled_by)
                         st.success(f"ID {customer['id']} → 처리중")
-                        st.rerun()
+                        st.rerun(scope="fragment")
                 else:
                     st.button(f"⚪ 처리중", key=f"processing_disabled_{customer['id']}", disabled=True)
             
@@ -465,14 +553,130 @@ def show_admin_view(sheets_manager, store_code=None):
                 # 완료 버튼 - 처리중일 때만 활성화
                 if customer['status'] == '처리중':
                     if st.button(f"✅ 완료", key=f"complete_{customer['id']}", disabled=False):
-                        sheets_manager.update_customer_status(customer['id'], '완료')
+                        sheets_manager.update_customer_status(customer['id'], '완료', store_code, **handled_by)
                         st.success(f"ID {customer['id']} → 완료")
-                        st.rerun()
+                        st.rerun(scope="fragment")
                 else:
                     st.button(f"⚪ 완료", key=f"complete_disabled_{customer['id']}", disabled=True)
 
             st.markdown("""</div></div>""", unsafe_allow_html=True)
 
+# 처리 시간 분석 (상태 변경 기록 기준)
+def show_service_metrics(sheets_manager, store_code):
+    with st.expander("⏱️ 처리 시간 분석"):
+        today = korea_today()
+        selected_dates = st.date_input(
+            "기간", value=(today - timedelta(days=6), today), max_value=today, key="metrics_dates"
+        )
+        if not isinstance(selected_dates, (list, tuple)) or len(selected_dates) != 2:
+            st.caption("시작일과 종료일을 선택하세요.")
+            return
+
+        metrics = sheets_manager.get_service_metrics(store_code, *selected_dates)
+        if not metrics['served']:
+            st.info("선택한 기간에 완료 기록이 없습니다.")
+            return
+
+        def minutes(value):
+            return "-" if value is None else f"{value:.1f}분"
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric("완료", f"{metrics['served']}명")
+        col2.metric("대기 시간 (중앙값)", minutes(metrics['median_wait']))
+        col3.metric("처리 시간 (중앙값)", minutes(metrics['median_service']))
+
+        # 등록 시 쓰는 예상 시간과 실제 처리 시간 비교
+        by_service_type = metrics['by_service_type']
+        by_service_type['estimated'] = by_service_type['service_type'].map(estimated_service_minutes)
+        st.markdown("**서비스 유형별**")
+        st.dataframe(
+            by_service_type.rename(columns={
+                'service_type': '서비스', 'served': '완료', 'median_service': '처리 시간 중앙값(분)',
+                'estimated': '현재 예상(분)'
+            }).round(1),
+            hide_index=True,
+            use_container_width=True
+        )
+
+        st.markdown("**창구별**")
+        st.dataframe(
+            metrics['by_counter'].rename(columns={
+                'counter': '창구', 'served': '완료', 'median_service': '처리 시간 중앙값(분)'
+            }).round(1),
+            hide_index=True,
+            use_container_width=True
+        )
+
+        st.markdown("**시간대별 처리 인원 (일 평균)**")
+        st.bar_chart(metrics['per_hour'].set_index('hour')['customers_per_hour'])
+
+# 팀/매장 대기 현황 (모든 매장을 고객 스냅샷 한 번으로 집계)
+@st.fragment(run_every=ADMIN_QUEUE_REFRESH_SECONDS)
+def show_store_dashboard(sheets_manager):
+    if not check_admin_permission():
+        return
+
+    st.subheader("📊 팀/매장 대기 현황")
+
+    summary = get_store_waiting_summary(sheets_manager)
+    if not summary:
+        st.info("표시할 매장이 없습니다.")
+        return
+
+    stores = pd.DataFrame(summary)
+    stores['team'] = stores['team'].replace('', '미지정')
+
+    # 팀별 합계
+    team_summary = stores.groupby('team').agg(
+        매장수=('store_code', 'size'),
+        대기=('waiting_count', 'sum'),
+        처리중=('processing_count', 'sum'),
+        최대예상시간=('estimated_time', 'max'),
+    ).reset_index().rename(columns={'team': '팀', '최대예상시간': '최대 예상(분)', '매장수': '매장 수'})
+    st.dataframe(team_summary, hide_index=True, use_container_width=True)
+
+    # 기본으로 로그인한 매장의 팀을 보여줌
+    teams = sorted(stores['team'].unique())
+    current_store = stores[stores['store_code'] == st.session_state.get('selected_store_code')]
+    default_team = current_store['team'].iloc[0] if not current_store.empty else None
+    options = ["전체"] + teams
+    selected_team = st.selectbox(
+        "👥 팀 선택", options,
+        index=options.index(default_team) if default_team in options else 0,
+        key="dashboard_team"
+    )
+    team_stores = stores if selected_team == "전체" else stores[stores['team'] == selected_team]
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("대기", f"{int(team_stores['waiting_count'].sum())}명")
+    col2.metric("처리중", f"{int(team_stores['processing_count'].sum())}명")
+    # 예상 시간을 계산할 수 없는 동안에는 값을 지어내지 않고 비워 둠
+    mean_estimated_time = pd.to_numeric(team_stores['estimated_time'], errors='coerce').mean()
+    col3.metric("평균 예상 시간", f"{mean_estimated_time:.0f}분" if pd.notna(mean_estimated_time) else "-")
+
+    st.dataframe(
+        team_stores.sort_values(by='waiting_count', ascending=False)[
+            ['store_name', 'team', 'waiting_count', 'processing_count', 'estimated_time', 'next_ticket']
+        ].rename(columns={
+            'store_name': '매장', 'team': '팀', 'waiting_count': '대기', 'processing_count': '처리중',
+            'estimated_time': '예상(분)', 'next_ticket': '다음 번호'
+        }),
+        hide_index=True,
+        use_container_width=True
+    )
+
+    # 최근 7일 발급/완료 추이 (발급 집계에서 조회)
+    end_date = korea_today()
+    daily = sheets_manager.get_ticket_stats(
+        end_date - timedelta(days=6), end_date, team_stores['store_code'].tolist(), by=("date",)
+    )
+    if not daily.empty:
+        st.markdown("#### 📈 최근 7일 발급/완료")
+        st.bar_chart(
+            daily.set_index('date')[['issued', 'completed']].rename(columns={'issued': '발급', 'completed': '완료'}),
+            stack=False
+        )
+
 # 고객 등록 화면 (Home.py의 함수 호출)
 def show_customer_view(sheets_manager, store_code=None):
     # 다크모드 최적화 CSS 추가
@@ -637,6 +841,7 @@ def show_admin_login(sheets_manager):
                 st.session_state['selected_store_code'] = store['store_code']
                 st.session_state['selected_store_name'] = store['store_name']
                 st.session_state['user_level'] = 'admin'  # 관리자 권한 설정
+                st.session_state['admin_user_id'] = admin_id.strip()
                 st.success(f"✅ {store['store_name']} 관리자 로그인 성공!")
                 st.rerun()
             else:
@@ -731,45 +936,73 @@ def show_logout_button():
                 del st.session_state['selected_store_name']
             if 'user_level' in st.session_state:
                 del st.session_state['user_level']
+            if 'admin_user_id' in st.session_state:
+                del st.session_state['admin_user_id']
             st.success("✅ 로그아웃되었습니다.")
             st.rerun()
 
 # 메인 함수
 def main():
-    workbook, client = init_google_sheets()
-    if workbook is None:
+    backend = init_storage_backend()
+    if backend is None:
         st.error("📛 Google Sheets 연결 오류")
         return
 
-    sheets_manager = SheetsManager(workbook)
+    # 한 번의 실행에서 시트 조회 결과 공유 (trace_calls가 켜져 있으면 호출 추적)
+    with request_scope(), trace_scope() as trace:
+        sheets_manager = SheetsManager(backend)
 
-    with st.sidebar:
-        if 'selected_store_name' in st.session_state:
-            user_level = st.session_state.get('user_level', 'customer')
-            level_text = "관리자" if user_level == 'admin' else "고객"
-            st.markdown(f"**🔓 {level_text} 로그인됨:** `{st.session_state['selected_store_name']}`")
-            show_logout_button()  # 로그아웃 버튼 추가
+        with st.sidebar:
+            if 'selected_store_name' in st.session_state:
+                user_level = st.session_state.get('user_level', 'customer')
+                level_text = "관리자" if user_level == 'admin' else "고객"
+                st.markdown(f"**🔓 {level_text} 로그인됨:** `{st.session_state['selected_store_name']}`")
+                show_logout_button()  # 로그아웃 버튼 추가
             
-            # 권한에 따른 메뉴 제한
-            if user_level == "admin":
-                # 관리자는 모든 메뉴 접근 가능
-                tab = st.radio("모드 선택", ["고객 등록", "전산 처리", "관리자 등록"])
+                # 권한에 따른 메뉴 제한
+                if user_level == "admin":
+                    # 관리자는 모든 메뉴 접근 가능
+                    tab = st.radio("모드 선택", ["고객 등록", "전산 처리", "매장 현황", "관리자 등록"])
+                else:
+                    # 고객은 고객 등록만 가능
+                    tab = st.radio("모드 선택", ["고객 등록"])
+                    st.info("ℹ️ 고객 모드: 고객 등록만 가능합니다")
             else:
-                # 고객은 고객 등록만 가능
-                tab = st.radio("모드 선택", ["고객 등록"])
-                st.info("ℹ️ 고객 모드: 고객 등록만 가능합니다")
-        else:
-            st.markdown("🔒 로그인되지 않음")
-            tab = st.radio("모드 선택", ["로그인", "관리자 등록"])
-
-    if tab == "로그인":
-        show_login(sheets_manager)
-    elif tab == "고객 등록":
-        show_customer_view(sheets_manager)
-    elif tab == "전산 처리":
-        show_admin_view(sheets_manager)
-    elif tab == "관리자 등록":
-        show_store_admin_settings(sheets_manager)
+                st.markdown("🔒 로그인되지 않음")
+                tab = st.radio("모드 선택", ["로그인", "관리자 등록"])
+
+        if tab == "로그인":
+            show_login(sheets_manager)
+        elif tab == "고객 등록":
+            show_customer_view(sheets_manager)
+        elif tab == "전산 처리":
+            show_admin_view(sheets_manager)
+        elif tab == "매장 현황":
+            show_store_dashboard(sheets_manager)
+        elif tab == "관리자 등록":
+            show_store_admin_settings(sheets_manager)
+
+        if trace is not None:
+            trace.page = tab
+            show_trace_panel(trace)
+
+# 호출 추적 디버그 패널 (trace_calls 설정 시)
+def show_trace_panel(trace):
+    summary = trace.summary()
+    with st.sidebar.expander("🛠️ 호출 추적"):
+        st.caption(
+            f"전체 {summary['total_ms']:.0f}ms · API {summary['api_calls']}회 · "
+            f"네트워크 {summary['network_ms']:.0f}ms · 파싱 {summary['parse_ms']:.0f}ms · 렌더 {summary['render_ms']:.0f}ms"
+        )
+        methods = pd.DataFrame.from_dict(summary['methods'], orient='index')
+        if not methods.empty:
+            st.dataframe(
+                methods.rename(columns={
+                    'calls': '호출', 'api_calls': 'API', 'rows': '행', 'bytes': '바이트',
+                    'network_ms': '네트워크(ms)', 'parse_ms': '파싱(ms)'
+                }),
+                use_container_width=True
+            )
 
 if __name__ == '__main__':
     main()
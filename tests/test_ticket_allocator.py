@@ -0,0 +1,136 @@
+"""동시 등록 시 고객 ID와 매장별 티켓 번호가 겹치지 않는지 확인하는 스트레스 테스트"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+import gspread
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import Home  # noqa: E402
+
+
+class FakeWorksheet:
+    """테스트용 최소 워크시트 (메모리의 2차원 리스트)
+
+    latency초만큼 읽은 값은 늦게 돌려주고 쓰기는 늦게 반영해, 번호를 읽고 행을
+    추가하기까지 다른 등록이 끼어들 수 있는 실제 API 호출처럼 동작합니다.
+    """
+
+    def __init__(self, title, values, sheet_id, latency=0.0):
+        self.title = title
+        self.id = sheet_id
+        self.values = [list(row) for row in values]
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self):
+        return max(1000, len(self.values))
+
+    def get_all_values(self, **kwargs):
+        with self._lock:
+            values = [list(row) for row in self.values]
+        time.sleep(self.latency)
+        return values
+
+    def append_row(self, row, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.values.append([str(cell) for cell in row])
+
+    def append_rows(self, rows, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            self.values.extend([str(cell) for cell in row] for row in rows)
+
+    def update_cell(self, row, col, value):
+        with self._lock:
+            while len(self.values) < row:
+                self.values.append([])
+            while len(self.values[row - 1]) < col:
+                self.values[row - 1].append('')
+            self.values[row - 1][col - 1] = str(value)
+
+
+class FakeWorkbook:
+    def __init__(self, sheets, latency=0.0):
+        self.sheets = {}
+        self.latency = latency
+        for title, values in sheets.items():
+            self.add_worksheet(title, values=values)
+
+    def worksheet(self, title):
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows=None, cols=None, values=None, **kwargs):
+        self.sheets[title] = FakeWorksheet(title, values or [], len(self.sheets) + 1, self.latency)
+        return self.sheets[title]
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+
+def make_workbook(latency=0.0):
+    return FakeWorkbook({
+        "stores": [Home.STORE_HEADERS, ["S1", "강남점", "A팀", "", ""], ["S2", "홍대점", "A팀", "", ""]],
+        "settings": [["key", "value"]],
+        "customers": [
+            Home.CUSTOMER_HEADERS,
+            ["1", "김*수", "010-1111-2222", "유심교체", "25-05-01, 10:00 AM", "완료", "S1", "3", "1"],
+            ["2", "이*희", "010-3333-4444", "기타", "25-05-01, 10:05 AM", "대기", "S2", "10", "1"],
+        ],
+    }, latency=latency)
+
+
+def test_parallel_registrations_get_unique_numbers():
+    # 시트 호출마다 지연을 두어 번호 조회와 행 추가 사이에 다른 등록이 반드시 끼어들게 함
+    workbook = make_workbook(latency=0.02)
+    backend = Home.GoogleSheetsBackend(workbook)
+    store_codes = ["S1", "S2"]
+    threads_per_store = 40
+    barrier = threading.Barrier(len(store_codes) * threads_per_store)
+    errors = []
+    issued = {store_code: [] for store_code in store_codes}
+
+    def register(store_code, n):
+        try:
+            barrier.wait()
+            ticket = Home.SheetsManager(backend).add_customer(
+                f"고객{n}", f"010-9{n:03d}-{n:04d}", "유심교체", store_code
+            )
+            # add_customer는 실패하면 예외 대신 None을 반환함
+            issued[store_code].append(ticket)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=register, args=(store_code, i * len(store_codes) + j))
+        for i in range(threads_per_store)
+        for j, store_code in enumerate(store_codes)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    for store_code in store_codes:
+        assert None not in issued[store_code]
+        # 기존 고객이 1번을 가지고 있으므로 2번부터 빠짐없이 한 번씩 발급
+        assert sorted(issued[store_code]) == list(range(2, threads_per_store + 2))
+
+    rows = workbook.worksheet("customers").get_all_values()[1:]
+    assert len(rows) == 2 + len(threads)
+
+    ids = [row[0] for row in rows]
+    assert len(set(ids)) == len(ids)
+
+    tickets = [(row[6], row[8]) for row in rows]
+    assert len(set(tickets)) == len(tickets)
+    for store_code in store_codes:
+        numbers = sorted(int(ticket) for code, ticket in tickets if code == store_code)
+        assert numbers == list(range(1, threads_per_store + 2))